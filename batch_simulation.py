@@ -0,0 +1,152 @@
+"""Vectorized version of the production system simulation that advances many
+independent replicas of SimulationEnvironment at once."""
+import numpy as np
+
+class BatchSimulationEnvironment:
+    """Simulation environment holding N replicas of the production system.
+
+    Every field of the scalar components is stored as an array of shape (N,),
+    so the parameters of each replica can be set independently, e.g.
+    ``batch.m1_mttf[:] = np.linspace(70, 120, batch.n_replicas)``.
+    """
+    def __init__(self, n_replicas, seed=None, rng=None):
+        self.n_replicas = n_replicas
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+
+        def full(value):
+            return np.full(n_replicas, value, dtype=float)
+
+        # Raw material inventory
+        self.lead_time = full(8)
+        self.reorder_point = full(10)
+        self.reorder_quantity = full(30)
+        self.inventory_max_capacity = full(100)
+        self.time_since_last_order = full(0)
+        self.inventory_position = self.reorder_quantity.copy()
+        self.inventory_on_hand = self.reorder_quantity.copy()
+        # Machine 1
+        self.m1_max_production_rate = full(10)
+        self.m1_production_rate = full(10)
+        self.m1_mttf = full(80)
+        self.m1_mttr = full(20)
+        self.m1_defect_rate = full(0.05)
+        self.m1_operational = np.ones(n_replicas, dtype=bool)
+        self.m1_downtime = full(0)
+        # Machine 2
+        self.m2_max_production_rate = full(8)
+        self.m2_production_rate = full(8)
+        self.m2_mttf = full(75)
+        self.m2_mttr = full(10)
+        self.m2_defect_rate = full(0.03)
+        self.m2_operational = np.ones(n_replicas, dtype=bool)
+        self.m2_downtime = full(0)
+        # Buffer and produced goods
+        self.buffer_max_capacity = full(50)
+        self.buffer_level = full(0)
+        self.produced_goods_max_capacity = full(100)
+        self.produced_goods_level = full(0)
+        # Demand
+        self.demand_mean = full(7)
+        self.demand_std = full(2)
+        self.accumulated_demand = full(0)
+        self.accumulated_fulfilled_demand = full(0)
+
+    @classmethod
+    def from_environment(cls, env, n_replicas, seed=None, rng=None):
+        """Create a batch whose replicas all start from the state of `env`."""
+        batch = cls(n_replicas, seed=seed, rng=rng)
+        raw = env.raw_material
+        batch.lead_time[:] = raw.lead_time
+        batch.reorder_point[:] = raw.reorder_point
+        batch.reorder_quantity[:] = raw.reorder_quantity
+        batch.inventory_max_capacity[:] = raw.max_capacity
+        batch.time_since_last_order[:] = raw.time_since_last_order
+        batch.inventory_position[:] = raw.inventory_position
+        batch.inventory_on_hand[:] = raw.inventory_on_hand
+        for prefix, machine in (("m1", env.machine1), ("m2", env.machine2)):
+            getattr(batch, prefix + "_max_production_rate")[:] = machine.max_production_rate
+            getattr(batch, prefix + "_production_rate")[:] = machine.production_rate
+            getattr(batch, prefix + "_mttf")[:] = machine.mttf
+            getattr(batch, prefix + "_mttr")[:] = machine.mttr
+            getattr(batch, prefix + "_defect_rate")[:] = machine.defect_rate
+            getattr(batch, prefix + "_operational")[:] = machine.status == "operational"
+            getattr(batch, prefix + "_downtime")[:] = machine.downtime
+        batch.buffer_max_capacity[:] = env.buffer.max_capacity
+        batch.buffer_level[:] = env.buffer.capacity
+        batch.produced_goods_max_capacity[:] = env.produced_goods.max_capacity
+        batch.produced_goods_level[:] = env.produced_goods.capacity
+        batch.demand_mean[:] = env.demand_mean
+        batch.demand_std[:] = env.demand_std
+        batch.accumulated_demand[:] = env.accumulated_demand
+        batch.accumulated_fulfilled_demand[:] = env.accumulated_fulfilled_demand
+        return batch
+
+    def _update_raw_material(self, consumed):
+        """Vectorized RawMaterialInventory.update()."""
+        self.time_since_last_order += 1
+        delivered = self.time_since_last_order == self.lead_time
+        self.inventory_on_hand[delivered] = self.inventory_position[delivered]
+        self.inventory_on_hand -= consumed
+        self.inventory_position -= consumed
+        reorder = self.inventory_position <= self.reorder_point
+        self.inventory_position[reorder] = np.minimum(
+            self.inventory_position[reorder] + self.reorder_quantity[reorder],
+            self.inventory_max_capacity[reorder])
+        self.time_since_last_order[reorder] = 0
+
+    def _operate_machines(self, prefix):
+        """Vectorized Machine.operate() for machine `prefix` of every replica."""
+        operational = getattr(self, prefix + "_operational")
+        downtime = getattr(self, prefix + "_downtime")
+        draw = self.rng.random(self.n_replicas)
+        failed = operational & (draw < 1 / getattr(self, prefix + "_mttf"))
+        repaired = ~operational & (draw < 1 / getattr(self, prefix + "_mttr"))
+        producing = operational & ~failed
+        downtime[~operational] += 1
+        downtime[failed] = 1
+        operational[:] = producing | repaired
+        rate = getattr(self, prefix + "_production_rate")
+        defect_rate = getattr(self, prefix + "_defect_rate")
+        return np.where(producing, rate * (1 - defect_rate), 0.0)
+
+    def step(self):
+        """Advance every replica by one time step."""
+        demand = np.maximum(0, np.trunc(
+            self.rng.normal(self.demand_mean, self.demand_std)))
+        # Raw material consumption
+        raw_material_consumed = np.minimum(self.inventory_on_hand,
+                                           self.m1_production_rate)
+        self._update_raw_material(raw_material_consumed)
+
+        # Machine 1 production
+        production_m1 = np.trunc(self._operate_machines("m1"))
+        self.buffer_level = np.minimum(self.buffer_level + production_m1,
+                                       self.buffer_max_capacity)
+
+        # Machine 2 production
+        available_from_buffer = np.minimum(self.m2_production_rate, self.buffer_level)
+        self.buffer_level -= available_from_buffer
+        production_m2 = np.trunc(np.minimum(self._operate_machines("m2"),
+                                            available_from_buffer))
+        self.produced_goods_level = np.minimum(
+            self.produced_goods_level + production_m2,
+            self.produced_goods_max_capacity)
+
+        # Fulfill demand
+        fulfilled_demand = np.minimum(demand, self.produced_goods_level)
+        self.produced_goods_level -= fulfilled_demand
+
+        self.accumulated_demand += demand
+        self.accumulated_fulfilled_demand += fulfilled_demand
+
+        return {
+            "raw_material_level": self.inventory_on_hand.copy(),
+            "production_m1": production_m1,
+            "production_m2": production_m2,
+            "buffer_level": self.buffer_level.copy(),
+            "produced_goods_level": self.produced_goods_level.copy(),
+            "demand": self.accumulated_demand.copy(),
+            "fulfilled_demand": self.accumulated_fulfilled_demand.copy(),
+            "m1_status": self.m1_operational.astype(int),
+            "m2_status": self.m2_operational.astype(int),
+        }
@@ -0,0 +1,181 @@
+"""
+Benchmarks of the hot paths of the project, with JSON baselines.
+
+    python benchmarks.py run --save baseline.json
+    python benchmarks.py compare baseline.json --threshold 0.2
+
+`run` times every benchmark at several problem sizes and prints the
+results. `compare` runs them again (or reads `--current`) and reports the
+benchmarks that got slower than the baseline by more than the threshold,
+exiting with status 1 if there are any.
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+def _best_time(function, repeat):
+    """Call `function` `repeat` times; return the shortest wall time and the
+    result of the last call."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def bench_step(size, repeat):
+    """SimulationEnvironment.step() throughput."""
+    from inventory_system import SimulationEnvironment
+    env = SimulationEnvironment(seed=0)
+
+    def run():
+        for _ in range(size):
+            env.step()
+    seconds, _ = _best_time(run, repeat)
+    return {'seconds': seconds, 'steps_per_second': size / seconds}
+
+def bench_generate_data(size, repeat):
+    """generate_data() to CSV and to the columnar format, on one worker."""
+    from inventory_data_generator import generate_data
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for output_format, name in (('csv', 'data.csv'), ('npy', 'data')):
+            path = os.path.join(directory, name)
+            seconds, _ = _best_time(
+                lambda: generate_data(size, path, n_scenarios=10, seed=0,
+                                      output_format=output_format), repeat)
+            paths = ([os.path.join(path, name) for name in os.listdir(path)]
+                     if os.path.isdir(path) else [path])
+            results[f'{output_format}_seconds'] = seconds
+            results[f'{output_format}_rows_per_second'] = size / seconds
+            results[f'{output_format}_bytes'] = sum(os.path.getsize(p) for p in paths)
+    results['seconds'] = results['csv_seconds'] + results['npy_seconds']
+    return results
+
+def bench_windowing(size, repeat, time_steps=10, batch_size=32):
+    """One epoch of window batches from a WindowedDataset (which replaced
+    create_sequences())."""
+    from windowed_dataset import WindowedDataset
+    rng = np.random.default_rng(0)
+    x = rng.random((size, 18), dtype=np.float32)
+    y = rng.random((size, 6), dtype=np.float32)
+    scenario_id = np.repeat(np.arange(10), -(-size // 10))[:size]
+
+    def epoch():
+        dataset = WindowedDataset(x, y, scenario_id, time_steps)
+        for _ in dataset.batches(batch_size, seed=0):
+            pass
+    seconds, _ = _best_time(epoch, repeat)
+    tracemalloc.start()
+    epoch()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': seconds, 'windows_per_second': size / seconds, 'peak_bytes': peak}
+
+def bench_redraw(size, repeat, frames=20):
+    """SimulationUI.update_plot() latency on the Agg backend, with `size`
+    records of history, appending one GUI update (48 steps) per frame."""
+    import types
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from dashboard_plot import DashboardPlot, TrajectoryHistory
+    from inventory_system import SimulationEnvironment
+    from inventory_system_gui import SimulationUI
+    env = SimulationEnvironment(seed=0)
+    history = TrajectoryHistory(capacity=size)
+    history.extend(env.run(size))
+    fig, ax = plt.subplots(3, sharex=True, figsize=(8, 8))
+    ui = types.SimpleNamespace(dashboard=DashboardPlot(fig, ax), history=history)
+    SimulationUI.update_plot(ui)
+    latencies = []
+    for _ in range(repeat):
+        for _ in range(frames):
+            history.extend(env.run(48))
+            start = time.perf_counter()
+            SimulationUI.update_plot(ui)
+            latencies.append(time.perf_counter() - start)
+    plt.close(fig)
+    return {'seconds': float(np.median(latencies)),
+            'p95_seconds': float(np.percentile(latencies, 95)),
+            'max_seconds': float(np.max(latencies))}
+
+# name: (function, problem sizes, quick problem sizes)
+BENCHMARKS = {
+    'step': (bench_step, [10_000, 100_000], [10_000]),
+    'generate_data': (bench_generate_data, [10_000, 100_000], [10_000]),
+    'windowing': (bench_windowing, [100_000, 1_000_000], [100_000]),
+    'redraw': (bench_redraw, [1_000, 8_760, 100_000], [1_000]),
+}
+
+def run_benchmarks(names=None, quick=False, repeat=3):
+    """Run the benchmarks `names` (all by default) and return their results
+    by benchmark and problem size."""
+    results = {}
+    for name in names or BENCHMARKS:
+        function, sizes, quick_sizes = BENCHMARKS[name]
+        results[name] = {}
+        for size in quick_sizes if quick else sizes:
+            results[name][str(size)] = function(size, repeat)
+            print(f"{name:>14} {size:>9}: {results[name][str(size)]['seconds']:.4f} s")
+    return {
+        'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                    'platform': platform.platform(), 'processor': platform.processor()},
+        'results': results,
+    }
+
+def compare(baseline, current, threshold=0.2):
+    """Return the (benchmark, size, baseline seconds, current seconds) of the
+    benchmarks slower than the baseline by more than `threshold`."""
+    regressions = []
+    for name, sizes in current['results'].items():
+        for size, result in sizes.items():
+            reference = baseline['results'].get(name, {}).get(size)
+            if reference is None:
+                continue
+            ratio = result['seconds'] / reference['seconds']
+            print(f"{name:>14} {size:>9}: {reference['seconds']:.4f} s -> "
+                  f"{result['seconds']:.4f} s ({ratio:.2f}x)")
+            if ratio > 1 + threshold:
+                regressions.append((name, size, reference['seconds'], result['seconds']))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command in ('run', 'compare'):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument('--only', nargs='+', choices=list(BENCHMARKS))
+        subparser.add_argument('--quick', action='store_true',
+                               help='only run the smallest problem sizes')
+        subparser.add_argument('--repeat', type=int, default=3)
+        subparser.add_argument('--save', help='write the results to this JSON file')
+    subparsers.choices['compare'].add_argument('baseline')
+    subparsers.choices['compare'].add_argument('--current',
+                                               help='compare these saved results instead of running')
+    subparsers.choices['compare'].add_argument('--threshold', type=float, default=0.2,
+                                               help='tolerated relative slowdown')
+    args = parser.parse_args()
+
+    if args.command == 'compare' and args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        current = run_benchmarks(args.only, args.quick, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for name, size, before, after in regressions:
+            print(f"Slower: {name} at size {size}, {before:.4f} s -> {after:.4f} s")
+        raise SystemExit(1 if regressions else 0)
@@ -0,0 +1,202 @@
+"""Matplotlib dashboard of the simulation history, redrawn incrementally."""
+import time
+import numpy as np
+
+from inventory_system import TRAJECTORY_DTYPE
+
+# (axis, history key, label) of each plotted series
+SERIES = [
+    (0, "demand", "Accumulated Demand"),
+    (0, "fulfilled_demand", "Accumulated Fulfilled Demand"),
+    (1, "raw_material_level", "Raw Material"),
+    (1, "buffer_level", "Buffer"),
+    (1, "produced_goods_level", "Produced Goods"),
+    (2, "production_m1", "Machine 1"),
+    (2, "production_m2", "Machine 2"),
+]
+
+class TrajectoryHistory:
+    """The last `capacity` records of a simulation trajectory, kept in a
+    fixed-size ring buffer."""
+    def __init__(self, capacity, dtype=TRAJECTORY_DTYPE):
+        self.records = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def extend(self, records):
+        """Append records, overwriting the oldest ones when full."""
+        self.total += len(records)
+        # Only the last `capacity` records can be kept
+        records = records[-self.capacity:]
+        start = (self.total - len(records)) % self.capacity
+        head = min(len(records), self.capacity - start)
+        self.records[start:start + head] = records[:head]
+        self.records[:len(records) - head] = records[head:]
+
+    def clear(self):
+        """Forget all the records."""
+        self.total = 0
+
+    def first_step(self):
+        """Time step of the oldest record kept."""
+        return self.total - len(self)
+
+    def ordered(self):
+        """Return the records kept, oldest first."""
+        if self.total <= self.capacity:
+            return self.records[:self.total]
+        start = self.total % self.capacity
+        return np.concatenate((self.records[start:], self.records[:start]))
+
+def minmax_downsample(x, y, n_bins):
+    """Reduce `y` to its minimum and maximum in each of `n_bins` consecutive
+    bins, in order, so that the peaks of the series stay visible."""
+    n = len(y)
+    if n <= 2 * n_bins:
+        return x, y
+    size = -(-n // n_bins)
+    n_bins = -(-n // size)
+    blocks = np.pad(y, (0, n_bins * size - n), mode="edge").reshape(n_bins, size)
+    low = blocks.argmin(axis=1)
+    high = blocks.argmax(axis=1)
+    offsets = np.arange(n_bins) * size
+    indices = np.column_stack((offsets + np.minimum(low, high),
+                               offsets + np.maximum(low, high))).ravel()
+    indices = np.minimum(indices, n - 1)
+    return x[indices], y[indices]
+
+class DashboardPlot:
+    """Demand, inventory levels and production rates on three stacked axes.
+
+    The lines are created once and updated with set_data(). As long as the
+    data fits in the current axis limits only the lines are redrawn over a
+    cached background (blitting); the full figure is redrawn when the limits
+    have to change, which they do with some headroom so that it is rare.
+
+    Only the part of the history inside the x limits is plotted, downsampled
+    to about two points per horizontal pixel. While the view follows the end
+    of the history the x limits are adapted automatically; zooming or
+    panning stops that until follow_latest() is called.
+    """
+    def __init__(self, fig, axes, max_fps=60):
+        self.fig = fig
+        self.axes = axes
+        self.min_frame_interval = 1 / max_fps
+        self.last_frame = 0
+        self.background = None
+        self.history = None
+        self.follow = True
+        self.rescaling = False
+        self.lines = {}
+        for axis_index, key, label in SERIES:
+            line, = axes[axis_index].plot([], [], label=label, animated=True)
+            self.lines[key] = line
+        for ax in axes:
+            ax.legend(loc="upper left")
+            # The limits are managed by _rescale()
+            ax.set_autoscale_on(False)
+        axes[0].set_ylabel("Demand")
+        axes[1].set_ylabel("Inventory Level")
+        axes[2].set_xlabel("Time")
+        axes[2].set_ylabel("Production Rate")
+        fig.canvas.mpl_connect("draw_event", self._on_draw)
+        # Shared axes only notify the axes whose limits were set directly
+        for ax in axes:
+            ax.callbacks.connect("xlim_changed", self._on_xlim_changed)
+
+    def _on_draw(self, event):
+        """Cache the background after a full redraw and draw the lines on it."""
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_lines()
+
+    def _on_xlim_changed(self, ax):
+        """Replot the history at the resolution of a view set by the user."""
+        if self.rescaling:
+            return
+        self.follow = False
+        if self.history is not None:
+            self._set_lines()
+            self._rescale()
+            self.fig.canvas.draw_idle()
+
+    def follow_latest(self):
+        """Adapt the x limits to the end of the history again."""
+        self.follow = True
+
+    def _draw_lines(self):
+        for line in self.lines.values():
+            line.axes.draw_artist(line)
+
+    @staticmethod
+    def _fit_limits(limits, low, high):
+        """Return new limits for data in [low, high], or None if `limits` still
+        fit: they must contain the data without being much larger than it."""
+        span = max(high - low, 1)
+        current_low, current_high = limits
+        if low >= current_low and high <= current_high and \
+                current_high - current_low <= 4 * span:
+            return None
+        return low - 0.05 * span, high + 0.25 * span
+
+    def _set_lines(self):
+        """Set the visible part of the history on the lines."""
+        records = self.history.ordered()
+        x = np.arange(self.history.first_step(), self.history.total)
+        if len(x):
+            x_min, x_max = self.axes[0].get_xlim()
+            first = max(np.searchsorted(x, x_min) - 1, 0)
+            last = np.searchsorted(x, x_max) + 1
+            records, x = records[first:last], x[first:last]
+        n_bins = max(int(self.axes[0].bbox.width), 1)
+        for key, line in self.lines.items():
+            line.set_data(*minmax_downsample(x, records[key], n_bins))
+
+    def _rescale(self):
+        """Adapt the axis limits to the data; return whether any changed."""
+        changed = False
+        self.rescaling = True
+        if self.follow:
+            x_limits = self._fit_limits(self.axes[0].get_xlim(),
+                                        self.history.first_step(), self.history.total - 1)
+            if x_limits is not None:
+                self.axes[0].set_xlim(x_limits)
+                self._set_lines()
+                changed = True
+        for ax in self.axes:
+            lows, highs = [], []
+            for line in ax.get_lines():
+                y = line.get_ydata()
+                if len(y):
+                    lows.append(np.min(y))
+                    highs.append(np.max(y))
+            if lows:
+                y_limits = self._fit_limits(ax.get_ylim(), min(lows), max(highs))
+                if y_limits is not None:
+                    ax.set_ylim(y_limits)
+                    changed = True
+        self.rescaling = False
+        return changed
+
+    def set_data(self, history, force=False):
+        """Plot a TrajectoryHistory.
+
+        Frames are skipped when they come faster than `max_fps` unless
+        `force`. Returns whether a frame was drawn.
+        """
+        self.history = history
+        now = time.monotonic()
+        if not force and now - self.last_frame < self.min_frame_interval:
+            return False
+        self.last_frame = now
+        self._set_lines()
+        canvas = self.fig.canvas
+        if (len(history) and self._rescale()) or self.background is None:
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            self._draw_lines()
+            canvas.blit(self.fig.bbox)
+        return True
@@ -0,0 +1,177 @@
+"""
+Warm-start refresh of the LSTM surrogate when new data is appended.
+
+    python incremental_training.py --data inventory_data.csv
+
+The first run registers the saved inventory_lstm_model.keras and
+inventory_scalers.npz as version 0, trained on every row of the data so
+far. Later runs load the latest version and fine-tune it for a few epochs on
+the rows appended since, mixed with a replay sample of older windows so that
+it does not forget them. The scalers stay fixed, so every version reads the
+same scaled inputs. Each version is saved under the checkpoint directory
+with its model, scalers and NumPy export, and listed in manifest.json with
+a hash of the rows it has seen, so that a regenerated dataset is refused
+instead of being taken for appended data.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from neural_network import (DEFAULT_CONFIG, custom_loss, default_source, export,
+                            keras_sequence, load_data, load_scalers, save_scalers, train)
+from windowed_dataset import WindowedDataset
+
+def read_manifest(checkpoint_dir):
+    """Return the manifest of a checkpoint directory, empty if there is none."""
+    path = os.path.join(checkpoint_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return {'versions': []}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def write_manifest(checkpoint_dir, manifest):
+    """Replace the manifest atomically."""
+    path = os.path.join(checkpoint_dir, 'manifest.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def save_checkpoint(checkpoint_dir, model, x_scaler, y_scaler, entry):
+    """Store a new version of the model (a Keras model, or the path of a
+    saved one) and its scalers, add `entry` to the manifest and return the
+    directory of the version."""
+    manifest = read_manifest(checkpoint_dir)
+    version = len(manifest['versions'])
+    directory = os.path.join(checkpoint_dir, f'v{version:04d}')
+    os.makedirs(directory)
+    if isinstance(model, str):
+        shutil.copy(model, os.path.join(directory, 'model.keras'))
+    else:
+        model.save(os.path.join(directory, 'model.keras'))
+    save_scalers(os.path.join(directory, 'scalers.npz'), x_scaler, y_scaler)
+    manifest['versions'].append({
+        'version': version, 'directory': os.path.basename(directory),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'), **entry})
+    write_manifest(checkpoint_dir, manifest)
+    return directory
+
+def load_checkpoint(checkpoint_dir, version=-1):
+    """Load the model and scalers of a version (the latest by default);
+    return them with its manifest entry."""
+    import tensorflow as tf
+    entry = read_manifest(checkpoint_dir)['versions'][version]
+    directory = os.path.join(checkpoint_dir, entry['directory'])
+    model = tf.keras.models.load_model(os.path.join(directory, 'model.keras'),
+                                       custom_objects={'custom_loss': custom_loss})
+    x_scaler, y_scaler = load_scalers(os.path.join(directory, 'scalers.npz'))
+    return model, x_scaler, y_scaler, entry
+
+def rows_fingerprint(x, y, n_rows, chunk_size=1_000_000):
+    """Hash of the first `n_rows` rows of the inputs and outputs."""
+    digest = hashlib.sha256()
+    for start in range(0, n_rows, chunk_size):
+        rows = slice(start, min(start + chunk_size, n_rows))
+        for values in (x, y):
+            digest.update(np.ascontiguousarray(values[rows], dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+def incremental_datasets(x, y, scenario_id, rows_seen, x_scaler, y_scaler, time_steps=10,
+                         validation_split=0.2, replay_ratio=0.25, seed=None):
+    """Split the windows of the rows after `rows_seen` into training and
+    validation datasets, and add to the training one `replay_ratio` times as
+    many windows drawn at random from the rows before."""
+    dataset = WindowedDataset(x, y, scenario_id, time_steps, x_scaler, y_scaler)
+    new_starts = dataset.starts[dataset.starts >= rows_seen]
+    old_starts = dataset.starts[dataset.starts + time_steps < rows_seen]
+    split_index = int(len(new_starts) * (1 - validation_split))
+    train_starts = new_starts[:split_index]
+    n_replay = min(int(len(train_starts) * replay_ratio), len(old_starts))
+    replay = np.random.default_rng(seed).choice(old_starts, n_replay, replace=False)
+    train_dataset = WindowedDataset(x, y, scenario_id, time_steps, x_scaler, y_scaler,
+                                    starts=np.sort(np.concatenate((train_starts, replay))))
+    val_dataset = WindowedDataset(x, y, scenario_id, time_steps, x_scaler, y_scaler,
+                                  starts=new_starts[split_index:])
+    return train_dataset, val_dataset
+
+def refresh(source=None, checkpoint_dir='checkpoints', model_path='inventory_lstm_model.keras',
+            scalers_path='inventory_scalers.npz', epochs=10, learning_rate=0.0001,
+            replay_ratio=0.25, config=None, seed=None):
+    """Fine-tune the latest version on the rows of `source` it has not seen
+    and save the result as a new version; return the new manifest entry, or
+    None when there is nothing new.
+
+    Without a manifest, the model at `model_path` with the scalers at
+    `scalers_path` is registered as version 0, having seen all of `source`.
+    """
+    source = source or default_source()
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    X, Y, scenario_id = load_data(source, config['input_features'], config['output_features'])
+    versions = read_manifest(checkpoint_dir)['versions']
+    if not versions:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        save_checkpoint(checkpoint_dir, model_path, *load_scalers(scalers_path), {
+            'parent': None, 'source': source, 'rows_seen': len(X),
+            'rows_fingerprint': rows_fingerprint(X, Y, len(X))})
+        print(f'Registered {model_path} as version 0')
+        return None
+
+    parent = versions[-1]
+    rows_seen = parent['rows_seen']
+    if len(X) < rows_seen or rows_fingerprint(X, Y, rows_seen) != parent['rows_fingerprint']:
+        raise ValueError(f'The first {rows_seen} rows of {source} are not those seen by '
+                         f'version {parent["version"]}: the data was regenerated rather '
+                         f'than appended to, so retrain from scratch in a new checkpoint '
+                         f'directory')
+    if len(X) - rows_seen <= config['time_steps']:
+        print('No new data to train on')
+        return None
+
+    import tensorflow as tf
+    model, x_scaler, y_scaler, _ = load_checkpoint(checkpoint_dir)
+    new_x = x_scaler.transform(np.asarray(X[rows_seen:]))
+    outside = np.mean((new_x < 0) | (new_x > 1))
+    if outside:
+        print(f'{outside:.1%} of the new inputs are outside the range of the scaler')
+
+    train_dataset, val_dataset = incremental_datasets(
+        X, Y, scenario_id, rows_seen, x_scaler, y_scaler, config['time_steps'],
+        config['validation_split'], replay_ratio, seed)
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss=custom_loss, metrics=['mae', 'mse'])
+    val_sequence = keras_sequence(val_dataset, batch_size=256, shuffle=False)
+    val_loss_before = float(model.evaluate(val_sequence, verbose=0)[0])
+    history = train(model, train_dataset, val_dataset, epochs=epochs)
+    val_loss_after = float(min(history.history['val_loss']))
+    print(f'Validation loss on the new data: {val_loss_before:.5f} -> {val_loss_after:.5f}')
+
+    directory = save_checkpoint(checkpoint_dir, model, x_scaler, y_scaler, {
+        'parent': parent['version'], 'source': source, 'rows_seen': len(X),
+        'rows_fingerprint': rows_fingerprint(X, Y, len(X)),
+        'new_rows': len(X) - rows_seen, 'train_windows': len(train_dataset),
+        'epochs': len(history.history['val_loss']),
+        'val_loss_before': val_loss_before, 'val_loss_after': val_loss_after,
+    })
+    export(model, x_scaler, y_scaler, val_dataset,
+           path=os.path.join(directory, 'inventory_surrogate.npz'))
+    return read_manifest(checkpoint_dir)['versions'][-1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=None,
+                        help='CSV file or columnar dataset directory')
+    parser.add_argument('--checkpoints', default='checkpoints')
+    parser.add_argument('--model', default='inventory_lstm_model.keras')
+    parser.add_argument('--scalers', default='inventory_scalers.npz')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--learning-rate', type=float, default=0.0001)
+    parser.add_argument('--replay-ratio', type=float, default=0.25,
+                        help='replayed old windows per new training window')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    refresh(args.data, args.checkpoints, args.model, args.scalers, epochs=args.epochs,
+            learning_rate=args.learning_rate, replay_ratio=args.replay_ratio, seed=args.seed)
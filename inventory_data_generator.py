@@ -1,70 +1,303 @@
 """
 File to generate training data from the inventory system simulation.
 """
+import argparse
+import json
 import os
-import random
 import csv
-from inventory_system import SimulationEnvironment
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+from inventory_system import TRAJECTORY_DTYPE, SimulationEnvironment, fresh_seed_sequence
 
-def generate_data(steps, output_file):
-    """Generate training data for the inventory system simulation."""
-    env = SimulationEnvironment()
-    output_path = os.path.join(output_file)
+# Randomized scenario parameters: (attribute path, low, high, integer)
+SCENARIO_PARAMETERS = [
+    ('raw_material.lead_time', 5, 10, True),
+    ('raw_material.reorder_point', 5, 15, True),
+    ('raw_material.reorder_quantity', 20, 40, True),
+    ('raw_material.max_capacity', 80, 120, True),
+    ('machine1.max_production_rate', 5, 30, True),
+    ('machine1.mttf', 70, 120, True),
+    ('machine1.mttr', 15, 30, True),
+    ('machine1.defect_rate', 0.01, 0.07, False),
+    ('machine2.max_production_rate', 5, 30, True),
+    ('machine2.mttf', 70, 120, True),
+    ('machine2.mttr', 15, 30, True),
+    ('machine2.defect_rate', 0.01, 0.07, False),
+    ('buffer.max_capacity', 20, 60, True),
+    ('produced_goods.max_capacity', 80, 150, True),
+    ('demand_mean', 3, 15, True),
+    ('demand_std', 0.5, 3.5, False),
+]
+
+HEADER = [
+    'm1_production', 'm2_production', 'buffer_level', 'produced_goods_level', 'demand', 'fulfilled_demand',
+    'm1_status', 'm2_status','lead_time', 'reorder_point', 'reorder_quantity', 'inventory_max_capacity', 'inventory_position',
+    'inventory_on_hand', 'm1_max_production_rate', 'm1_mttf', 'm1_mttr', 'm1_defect_rate',
+    'm1_downtime', 'm2_max_production_rate', 'm2_mttf', 'm2_mttr', 'm2_defect_rate', 'm2_downtime',
+    'buffer_max_capacity', 'produced_goods_max_capacity']
+
+# Static parameters of each scenario, in order
+PARAMETER_COLUMNS = [
+    'lead_time', 'reorder_point', 'reorder_quantity', 'inventory_max_capacity',
+    'inventory_position', 'inventory_on_hand', 'm1_max_production_rate', 'm1_mttf',
+    'm1_mttr', 'm1_defect_rate', 'm1_downtime', 'm2_max_production_rate', 'm2_mttf',
+    'm2_mttr', 'm2_defect_rate', 'm2_downtime', 'buffer_max_capacity',
+    'produced_goods_max_capacity']
+
+# Per-step outputs of SimulationEnvironment.step(), in order
+TRAJECTORY_COLUMNS = list(TRAJECTORY_DTYPE.names)
+
+# Names of trajectory columns used by the surrogate features
+FEATURE_ALIASES = {'m1_production': 'production_m1', 'm2_production': 'production_m2'}
+
+# Static parameter columns set by SCENARIO_PARAMETERS
+PARAMETER_PATHS = {
+    'lead_time': 'raw_material.lead_time',
+    'reorder_point': 'raw_material.reorder_point',
+    'reorder_quantity': 'raw_material.reorder_quantity',
+    'inventory_max_capacity': 'raw_material.max_capacity',
+    'm1_max_production_rate': 'machine1.max_production_rate',
+    'm1_mttf': 'machine1.mttf',
+    'm1_mttr': 'machine1.mttr',
+    'm1_defect_rate': 'machine1.defect_rate',
+    'm2_max_production_rate': 'machine2.max_production_rate',
+    'm2_mttf': 'machine2.mttf',
+    'm2_mttr': 'machine2.mttr',
+    'm2_defect_rate': 'machine2.defect_rate',
+    'buffer_max_capacity': 'buffer.max_capacity',
+    'produced_goods_max_capacity': 'produced_goods.max_capacity',
+}
+
+# Actual columns of the rows of the CSV file; HEADER names one column fewer,
+# in another order, so the columns must be read by position
+CSV_COLUMNS = PARAMETER_COLUMNS + TRAJECTORY_COLUMNS
+
+def feature_column(name, columns=None):
+    """Return the table, 'parameters' or 'trajectory', and the index in it of
+    the feature `name`, given the `columns` of both tables (those of this
+    module by default)."""
+    columns = columns or {'parameters': PARAMETER_COLUMNS, 'trajectory': TRAJECTORY_COLUMNS}
+    name = FEATURE_ALIASES.get(name, name)
+    if name in columns['trajectory']:
+        return 'trajectory', columns['trajectory'].index(name)
+    return 'parameters', columns['parameters'].index(name)
+
+def scenario_features(parameters, trajectory, names):
+    """Select the features `names` from the static parameters and the
+    trajectory of one simulated scenario."""
+    columns = []
+    for name in names:
+        table, index = feature_column(name)
+        if table == 'trajectory':
+            columns.append(trajectory[:, index])
+        else:
+            columns.append(np.full(len(trajectory), parameters[index]))
+    return np.column_stack(columns).astype(np.float32)
+
+def parameter_ranges(names):
+    """Return the (low, high) range of SCENARIO_PARAMETERS of each of
+    `names` that is a randomized static parameter."""
+    ranges = {path: (low, high) for path, low, high, _ in SCENARIO_PARAMETERS}
+    return {name: ranges[PARAMETER_PATHS[name]] for name in names if name in PARAMETER_PATHS}
+
+def sample_scenario(rng):
+    """Sample a scenario as a dict of attribute path to value."""
+    scenario = {}
+    for path, low, high, integer in SCENARIO_PARAMETERS:
+        if integer:
+            scenario[path] = int(rng.integers(low, high + 1))
+        else:
+            scenario[path] = float(rng.uniform(low, high))
+    return scenario
+
+def apply_scenario(env, scenario):
+    """Set the scenario parameters on the simulation environment."""
+    for path, value in scenario.items():
+        *components, attribute = path.split('.')
+        target = env
+        for component in components:
+            target = getattr(target, component)
+        setattr(target, attribute, value)
+
+def scenario_parameters(env):
+    """Return the static parameters of the scenario loaded in `env`."""
+    return {
+        'lead_time': float(env.raw_material.lead_time),
+        'reorder_point': float(env.raw_material.reorder_point),
+        'reorder_quantity': float(env.raw_material.reorder_quantity),
+        'inventory_max_capacity': float(env.raw_material.max_capacity),
+        'inventory_position': float(env.raw_material.inventory_position),
+        'inventory_on_hand': float(env.raw_material.inventory_on_hand),
+        'm1_max_production_rate': float(env.machine1.max_production_rate),
+        'm1_mttf': float(env.machine1.mttf),
+        'm1_mttr': float(env.machine1.mttr),
+        'm1_defect_rate': float(env.machine1.defect_rate),
+        'm1_downtime': float(env.machine1.downtime),
+        'm2_max_production_rate': float(env.machine2.max_production_rate),
+        'm2_mttf': float(env.machine2.mttf),
+        'm2_mttr': float(env.machine2.mttr),
+        'm2_defect_rate': float(env.machine2.defect_rate),
+        'm2_downtime': float(env.machine2.downtime),
+        'buffer_max_capacity': float(env.buffer.max_capacity),
+        'produced_goods_max_capacity': float(env.produced_goods.max_capacity)
+    }
+
+def simulate_scenario(seed_sequence, steps, scenario=None):
+    """Simulate one scenario on a fresh environment, a randomized one unless
+    `scenario` is given.
+
+    All the randomness of the scenario comes from `seed_sequence`, so the
+    result does not depend on the process it runs in. Returns the static
+    parameters of the scenario and an array with the outputs of each step.
+    """
+    scenario_seed, simulation_seed = fresh_seed_sequence(seed_sequence).spawn(2)
+    if scenario is None:
+        scenario = sample_scenario(np.random.default_rng(scenario_seed))
+    env = SimulationEnvironment(seed=simulation_seed)
+    apply_scenario(env, scenario)
+    parameters = np.array(list(scenario_parameters(env).values()))
+    trajectory = structured_to_unstructured(env.run(steps), dtype=float)
+    return parameters, trajectory
+
+def _simulate_scenario(args):
+    return simulate_scenario(*args)
+
+def simulate_scenarios(steps, n_scenarios=100, seed=None, workers=1, scenarios=None):
+    """Yield the parameters and trajectory of each scenario in order, simulated by `workers`
+    processes (one per core if None). The scenarios are randomized unless a
+    list of `scenarios` (dicts as returned by sample_scenario()) is given."""
+    if scenarios is not None:
+        n_scenarios = len(scenarios)
+    else:
+        scenarios = [None] * n_scenarios
+    scenario_seeds = np.random.SeedSequence(seed).spawn(n_scenarios)
+    tasks = [(scenario_seed, int(steps / n_scenarios), scenario)
+             for scenario_seed, scenario in zip(scenario_seeds, scenarios)]
+    if workers == 1:
+        yield from map(_simulate_scenario, tasks)
+        return
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_simulate_scenario, tasks,
+                                chunksize=max(1, n_scenarios // (4 * workers)))
+
+def _simulate_branch(args):
+    snapshot, steps, scenario = args
+    env = SimulationEnvironment.from_snapshot(snapshot)
+    apply_scenario(env, scenario)
+    parameters = np.array(list(scenario_parameters(env).values()))
+    return parameters, structured_to_unstructured(env.run(steps), dtype=float)
+
+def simulate_branches(env, scenarios, steps, common=True, workers=1):
+    """Yield the parameters and trajectory of each of `scenarios` simulated
+    for `steps` steps from the current state of `env`, e.g. after a warm-up,
+    instead of from a cold start.
+
+    The branches are forks of `env` (see SimulationEnvironment.fork()), with
+    common random numbers unless `common` is False, and are sent to the
+    `workers` processes (one per core if None) as snapshots.
+    """
+    tasks = [(fork.snapshot(), steps, scenario)
+             for fork, scenario in zip(env.fork(len(scenarios), common), scenarios)]
+    if workers == 1:
+        yield from map(_simulate_branch, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        yield from executor.map(_simulate_branch, tasks)
+
+def _write_csv(scenarios, output_path):
     with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
         # Add header
-        header = [
-            'm1_production', 'm2_production', 'buffer_level', 'produced_goods_level', 'demand', 'fulfilled_demand',
-            'm1_status', 'm2_status','lead_time', 'reorder_point', 'reorder_quantity', 'inventory_max_capacity', 'inventory_position',
-            'inventory_on_hand', 'm1_max_production_rate', 'm1_mttf', 'm1_mttr', 'm1_defect_rate',
-            'm1_downtime', 'm2_max_production_rate', 'm2_mttf', 'm2_mttr', 'm2_defect_rate', 'm2_downtime',
-            'buffer_max_capacity', 'produced_goods_max_capacity']
-        writer.writerow(header)
-        for _ in range(100):
-            # Randomize data for the next step
-            env.raw_material.lead_time = random.randint(5, 10)
-            env.raw_material.reorder_point = random.randint(5, 15)
-            env.raw_material.reorder_quantity = random.randint(20, 40)
-            env.raw_material.max_capacity = random.randint(80, 120)
-            env.machine1.max_production_rate = random.randint(5, 30)
-            env.machine1.mttf = random.randint(70, 120)
-            env.machine1.mttr = random.randint(15, 30)
-            env.machine1.defect_rate = random.uniform(0.01, 0.07)
-            env.machine2.max_production_rate = random.randint(5, 30)
-            env.machine2.mttf = random.randint(70, 120)
-            env.machine2.mttr = random.randint(15, 30)
-            env.machine2.defect_rate = random.uniform(0.01, 0.07)
-            env.buffer.max_capacity = random.randint(20, 60)
-            env.produced_goods.max_capacity = random.randint(80, 150)
-            env.demand_mean = random.randint(3, 15)
-            env.demand_std = random.uniform(0.5, 3.5)
-            data = {
-                'lead_time': float(env.raw_material.lead_time),
-                'reorder_point': float(env.raw_material.reorder_point),
-                'reorder_quantity': float(env.raw_material.reorder_quantity),
-                'inventory_max_capacity': float(env.raw_material.max_capacity),
-                'inventory_position': float(env.raw_material.inventory_position),
-                'inventory_on_hand': float(env.raw_material.inventory_on_hand),
-                'm1_max_production_rate': float(env.machine1.max_production_rate),
-                'm1_mttf': float(env.machine1.mttf),
-                'm1_mttr': float(env.machine1.mttr),
-                'm1_defect_rate': float(env.machine1.defect_rate),
-                'm1_downtime': float(env.machine1.downtime),
-                'm2_max_production_rate': float(env.machine2.max_production_rate),
-                'm2_mttf': float(env.machine2.mttf),
-                'm2_mttr': float(env.machine2.mttr),
-                'm2_defect_rate': float(env.machine2.defect_rate),
-                'm2_downtime': float(env.machine2.downtime),
-                'buffer_max_capacity': float(env.buffer.max_capacity),
-                'produced_goods_max_capacity': float(env.produced_goods.max_capacity)
-            }
-            for _ in range(int(steps/100)):
-                dynamic_data = env.step()
-                # All values to float
-                dynamic_data = {k: float(v) for k, v in dynamic_data.items()}
-                data.update(dynamic_data)
-                writer.writerow(data.values())
+        writer.writerow(HEADER)
+        for parameters, trajectory in scenarios:
+            rows = np.hstack([np.broadcast_to(parameters, (len(trajectory), len(parameters))),
+                              trajectory])
+            writer.writerows(rows.tolist())
 
+def _write_columnar(scenarios, output_path, n_scenarios, steps_per_scenario):
+    os.makedirs(output_path, exist_ok=True)
+    n_rows = n_scenarios * steps_per_scenario
+    parameter_table = np.lib.format.open_memmap(
+        os.path.join(output_path, 'parameters.npy'), mode='w+', dtype=np.float32,
+        shape=(n_scenarios, len(PARAMETER_COLUMNS)))
+    trajectory_table = np.lib.format.open_memmap(
+        os.path.join(output_path, 'trajectory.npy'), mode='w+', dtype=np.float32,
+        shape=(n_rows, len(TRAJECTORY_COLUMNS)))
+    scenario_id = np.lib.format.open_memmap(
+        os.path.join(output_path, 'scenario_id.npy'), mode='w+', dtype=np.int32,
+        shape=(n_rows,))
+    for i, (parameters, trajectory) in enumerate(scenarios):
+        rows = slice(i * steps_per_scenario, (i + 1) * steps_per_scenario)
+        parameter_table[i] = parameters
+        trajectory_table[rows] = trajectory
+        scenario_id[rows] = i
+    for table in (parameter_table, trajectory_table, scenario_id):
+        table.flush()
+    with open(os.path.join(output_path, 'columns.json'), 'w', encoding='utf-8') as f:
+        json.dump({'parameters': PARAMETER_COLUMNS, 'trajectory': TRAJECTORY_COLUMNS}, f, indent=2)
+
+def load_columnar(path, mmap_mode='r'):
+    """Load a dataset written with output_format='npy'.
+
+    Returns a dict with the `parameters` table (one row per scenario), the
+    `trajectory` table (one row per step), the `scenario_id` of each
+    trajectory row and the `columns` of both tables. The arrays are memory
+    mapped unless `mmap_mode` is None.
+    """
+    with open(os.path.join(path, 'columns.json'), encoding='utf-8') as f:
+        columns = json.load(f)
+    data = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+            for name in ('parameters', 'trajectory', 'scenario_id')}
+    data['columns'] = columns
+    return data
+
+def generate_data(steps, output_file, n_scenarios=100, seed=None, workers=1,
+                  output_format='csv', scenarios=None):
+    """Generate training data for the inventory system simulation.
+
+    `steps` is split evenly over `n_scenarios` randomized scenarios. Each
+    scenario gets an independent random stream derived from the master
+    `seed`, and the scenarios are written in order, so the output is the
+    same for any number of `workers`. A list of `scenarios`, e.g. from
+    scenario_design.base_design(), replaces the randomized ones.
+
+    With `output_format='npy'`, `output_file` is a directory that receives
+    float32 tables written scenario by scenario: `parameters.npy` with the
+    static parameters of each scenario, `trajectory.npy` with the outputs of
+    each step and `scenario_id.npy` linking each step to its scenario. See
+    load_columnar().
+    """
+    if scenarios is not None:
+        n_scenarios = len(scenarios)
+    scenarios = simulate_scenarios(steps, n_scenarios, seed, workers, scenarios)
+    output_path = os.path.join(output_file)
+    if output_format == 'csv':
+        _write_csv(scenarios, output_path)
+    elif output_format == 'npy':
+        _write_columnar(scenarios, output_path, n_scenarios, int(steps / n_scenarios))
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
 
 if __name__ == "__main__":
-    generate_data(1000, 'inventory_data.csv')
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--scenarios', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, 0 for one per core')
+    parser.add_argument('--format', choices=['csv', 'npy'], default='csv')
+    parser.add_argument('--design', choices=['random', 'lhs', 'sobol'], default='random',
+                        help='how the scenario parameters are sampled')
+    parser.add_argument('--output', default=None,
+                        help='output file, or directory for the npy format')
+    args = parser.parse_args()
+    output = args.output or ('inventory_data.csv' if args.format == 'csv' else 'inventory_data')
+    scenarios = None
+    if args.design != 'random':
+        from scenario_design import base_design
+        scenarios = base_design(args.scenarios, method=args.design, seed=args.seed)
+    generate_data(args.steps, output, n_scenarios=args.scenarios,
+                  seed=args.seed, workers=args.workers or None, output_format=args.format,
+                  scenarios=scenarios)
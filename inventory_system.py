@@ -1,10 +1,151 @@
 """Time-series simulation of a simple production system with two machines, a
 buffer, and a raw material inventory."""
-import random
+import math
 import numpy as np
 
+# One record per time step, with the fields returned by step()
+TRAJECTORY_DTYPE = np.dtype([
+    ("raw_material_level", np.float64),
+    ("production_m1", np.float64),
+    ("production_m2", np.float64),
+    ("buffer_level", np.float64),
+    ("produced_goods_level", np.float64),
+    ("demand", np.float64),
+    ("fulfilled_demand", np.float64),
+    ("m1_status", np.int8),
+    ("m2_status", np.int8),
+])
+
+def _generator_state(rng):
+    """Return the state of a numpy Generator as builtins, with its seed
+    sequence so that it can still spawn the same children."""
+    seed_sequence = rng.bit_generator.seed_seq
+    return {
+        "bit_generator": rng.bit_generator.state,
+        "seed_sequence": None if seed_sequence is None else {
+            "entropy": seed_sequence.entropy,
+            "spawn_key": seed_sequence.spawn_key,
+            "pool_size": seed_sequence.pool_size,
+            "n_children_spawned": seed_sequence.n_children_spawned,
+        },
+    }
+
+def _restore_generator(state):
+    """Create a numpy Generator from the result of _generator_state()."""
+    seed_sequence = None
+    if state["seed_sequence"] is not None:
+        seed_sequence = np.random.SeedSequence(**state["seed_sequence"])
+    bit_generator = getattr(np.random, state["bit_generator"]["bit_generator"])(seed_sequence)
+    bit_generator.state = state["bit_generator"]
+    return np.random.Generator(bit_generator)
+
+# Antithetic counterpart of a variate of each symmetric distribution
+ANTITHETIC = {
+    "random": lambda values: 1 - values,
+    "standard_normal": lambda values: -values,
+}
+
+class RandomStream:
+    """Random variates of one distribution, drawn from a numpy Generator in
+    blocks of `block_size` and handed out one at a time.
+
+    With `antithetic` every variate is mirrored (1 - u, or -z for the normal
+    distribution), so two streams on identically seeded generators, one of
+    them antithetic, give negatively correlated variates.
+    """
+    __slots__ = ("rng", "distribution", "block_size", "antithetic", "block", "index",
+                 "block_state")
+
+    def __init__(self, rng, distribution="random", block_size=4096, antithetic=False):
+        if antithetic and distribution not in ANTITHETIC:
+            raise ValueError(f"No antithetic variates for the {distribution} distribution")
+        self.rng = rng
+        self.distribution = distribution
+        self.block_size = block_size
+        self.antithetic = antithetic
+        self.block = []
+        self.index = 0
+        self.block_state = None
+
+    def next(self):
+        """Return the next variate, drawing a new block when needed."""
+        if self.index == len(self.block):
+            # Kept so that a snapshot can draw the block again instead of storing it
+            self.block_state = self.rng.bit_generator.state
+            block = getattr(self.rng, self.distribution)(self.block_size)
+            if self.antithetic:
+                block = ANTITHETIC[self.distribution](block)
+            self.block = block.tolist()
+            self.index = 0
+        value = self.block[self.index]
+        self.index += 1
+        return value
+
+    def draw(self, size=None):
+        """Return `size` variates (one if None) straight from the generator,
+        bypassing the block, mirrored like the others if antithetic."""
+        values = getattr(self.rng, self.distribution)(size)
+        return ANTITHETIC[self.distribution](values) if self.antithetic else values
+
+    def snapshot(self):
+        """Return the state of the stream as builtins."""
+        return {"rng": _generator_state(self.rng), "distribution": self.distribution,
+                "block_size": self.block_size, "antithetic": self.antithetic,
+                "block_state": self.block_state, "index": self.index,
+                "block_length": len(self.block)}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Create a stream in the state of snapshot()."""
+        stream = cls(_restore_generator(snapshot["rng"]), snapshot["distribution"],
+                     snapshot["block_size"], snapshot["antithetic"])
+        if snapshot["block_length"]:
+            # Draw the block again, then go back to the state after it
+            state = stream.rng.bit_generator.state
+            stream.rng.bit_generator.state = snapshot["block_state"]
+            stream.next()
+            stream.index = snapshot["index"]
+            stream.rng.bit_generator.state = state
+        return stream
+
+def fresh_seed_sequence(seed_sequence):
+    """Return a copy of `seed_sequence` that has not spawned any children.
+
+    SeedSequence.spawn() advances the sequence, so spawning twice from the
+    same one gives different children; spawning from a fresh copy instead
+    makes everything derived from a seed sequence depend on it alone.
+    """
+    return np.random.SeedSequence(seed_sequence.entropy, spawn_key=seed_sequence.spawn_key,
+                                  pool_size=seed_sequence.pool_size)
+
+def _clamped_walk(start, shift, high):
+    """Return x[1..n] for x[t+1] = min(max(x[t] + shift[t], 0), high[t]).
+
+    The per-step clamp maps are composed with a doubling prefix scan, so the
+    Python-level work is logarithmic in the number of steps.
+    """
+    shift = np.asarray(shift, dtype=float).copy()
+    low = np.zeros_like(shift)
+    high = np.asarray(high, dtype=float).copy()
+    offset = 1
+    while offset < len(shift):
+        current_shift = shift[offset:]
+        current_low = low[offset:]
+        current_high = high[offset:]
+        new_low = np.clip(low[:-offset] + current_shift, current_low, current_high)
+        new_high = np.clip(high[:-offset] + current_shift, current_low, current_high)
+        shift[offset:] = shift[:-offset] + current_shift
+        low[offset:] = new_low
+        high[offset:] = new_high
+        offset *= 2
+    return np.clip(start + shift, low, high)
+
 class RawMaterialInventory:
     """Buffer for the raw material inventory."""
+    __slots__ = ("max_capacity", "lead_time", "time_since_last_order", "reorder_point",
+                 "reorder_quantity", "inventory_position", "inventory_on_hand",
+                 "orders_placed")
+
     def __init__(self, lead_time, reorder_point, reorder_quantity, max_capacity):
         self.max_capacity = max_capacity
         self.lead_time = lead_time
@@ -13,6 +154,7 @@ class RawMaterialInventory:
         self.reorder_quantity = reorder_quantity
         self.inventory_position = reorder_quantity
         self.inventory_on_hand = reorder_quantity
+        self.orders_placed = 0
 
     def update(self, demand):
         """Update the inventory level based on the demand requested."""
@@ -29,6 +171,38 @@ class RawMaterialInventory:
         self.inventory_position += self.reorder_quantity
         self.inventory_position = min(self.inventory_position, self.max_capacity)
         self.time_since_last_order = 0
+        self.orders_placed += 1
+
+    def advance(self, steps, consumption_rate):
+        """Event-skipping equivalent of calling update() `steps` times, with the
+        consumption of each step being min(inventory_on_hand, consumption_rate).
+
+        Between a delivery and the next reorder the inventory evolves
+        deterministically, so the steps in between are applied in closed form
+        and only the event steps are simulated one by one.
+        """
+        remaining = steps
+        while remaining > 0:
+            if consumption_rate <= 0 or self.inventory_on_hand < 0:
+                self.update(min(self.inventory_on_hand, consumption_rate))
+                remaining -= 1
+                continue
+            next_event = remaining
+            until_delivery = self.lead_time - self.time_since_last_order
+            if until_delivery >= 1 and until_delivery == int(until_delivery):
+                next_event = min(next_event, int(until_delivery))
+            shortfall = self.inventory_position - self.reorder_point
+            if shortfall <= self.inventory_on_hand:
+                until_reorder = max(1, math.ceil(shortfall / consumption_rate))
+                next_event = min(next_event, until_reorder)
+            # Steps before the event only consume raw material
+            quiet_steps = next_event - 1
+            consumed = min(quiet_steps * consumption_rate, self.inventory_on_hand)
+            self.inventory_on_hand -= consumed
+            self.inventory_position -= consumed
+            self.time_since_last_order += quiet_steps
+            self.update(min(self.inventory_on_hand, consumption_rate))
+            remaining -= next_event
 
     def set_order_point_and_quantity(self, reorder_point, reorder_quantity):
         """Set the reorder point and reorder quantity."""
@@ -37,7 +211,13 @@ class RawMaterialInventory:
 
 class Machine:
     """Machine in the production system."""
-    def __init__(self, max_production_rate, mttf, mttr, defect_rate):
+    __slots__ = ("stream", "max_production_rate", "mttf", "mttr", "defect_rate",
+                 "production_rate", "status", "downtime")
+
+    def __init__(self, max_production_rate, mttf, mttr, defect_rate, rng=None,
+                 antithetic=False):
+        self.stream = RandomStream(rng if rng is not None else np.random.default_rng(),
+                                   antithetic=antithetic)
         self.max_production_rate = max_production_rate
         self.mttf = mttf
         self.mttr = mttr
@@ -49,19 +229,64 @@ class Machine:
     def operate(self):
         """Operate the machine for one time step."""
         if self.status == "operational":
-            if random.random() < 1 / self.mttf:
+            if self.stream.next() < 1 / self.mttf:
                 self.status = "failed"
                 self.downtime = 1
                 return 0
             return self.production_rate * (1 - self.defect_rate)
         else:
             self.downtime += 1
-            if random.random() < 1 / self.mttr:
+            if self.stream.next() < 1 / self.mttr:
                 self.status = "operational"
             return 0
 
+    def time_to_next_event(self):
+        """Sample the number of steps until the next status change, counting
+        the step in which it happens."""
+        mean_time = self.mttf if self.status == "operational" else self.mttr
+        # Geometric by inversion of a uniform of the stream, so that it is
+        # mirrored with the stream
+        failure = min(1 / mean_time, 1.0)
+        if failure == 1.0:
+            return 1
+        return max(1, math.ceil(math.log1p(-self.stream.draw()) / math.log1p(-failure)))
+
+    def advance(self, steps):
+        """Event-skipping equivalent of calling operate() `steps` times.
+
+        Returns the producing periods as a list of (start, end) step ranges.
+        The status and downtime are left as after the last of those steps.
+        """
+        periods = []
+        elapsed = 0
+        while elapsed < steps:
+            event_step = elapsed + self.time_to_next_event()
+            if self.status == "operational":
+                periods.append((elapsed, min(event_step - 1, steps)))
+                if event_step <= steps:
+                    self.status = "failed"
+                    self.downtime = 1
+            else:
+                self.downtime += min(event_step, steps) - elapsed
+                if event_step <= steps:
+                    self.status = "operational"
+            elapsed = event_step
+        return periods
+
+    def output_per_step(self, periods, steps):
+        """Return the output of each of `steps` steps for the given producing
+        periods."""
+        boundaries = np.zeros(steps + 1)
+        for start, end in periods:
+            boundaries[start] += 1
+            boundaries[end] -= 1
+        producing = np.cumsum(boundaries[:-1]) > 0
+        return producing * (self.production_rate * (1 - self.defect_rate))
+
 class Buffer:
     """Buffer for the goods produced by the machines."""
+    __slots__ = ("holding_cost", "max_capacity", "capacity")
+
     def __init__(self, holding_cost, max_capacity):
         self.holding_cost = holding_cost
         self.max_capacity = max_capacity
@@ -79,6 +304,8 @@ class Buffer:
 
 class ProducedGoods:
     """Inventory for the produced goods."""
+    __slots__ = ("holding_cost", "max_capacity", "selling_cost", "capacity")
+
     def __init__(self, holding_cost, max_capacity, selling_cost):
         self.holding_cost = holding_cost
         self.max_capacity = max_capacity
@@ -96,16 +323,31 @@ class ProducedGoods:
         return removed
 
 class SimulationEnvironment:
-    """Simulation environment for the production system."""
-    def __init__(self):
+    """Simulation environment for the production system.
+
+    All the randomness comes from `rng`, or from a new Generator seeded with
+    `seed`, which is split into independent streams for the demand and the
+    failures and repairs of each machine. Environments with the same seed
+    therefore see the same demand and machine draws whatever their
+    parameters (common random numbers), and with `antithetic` they see the
+    mirrored draws instead.
+    """
+    def __init__(self, seed=None, rng=None, antithetic=False):
+        if isinstance(seed, np.random.SeedSequence):
+            seed = fresh_seed_sequence(seed)
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        demand_rng, m1_rng, m2_rng = self.rng.spawn(3)
+        self.demand_stream = RandomStream(demand_rng, "standard_normal", antithetic=antithetic)
         self.raw_material = RawMaterialInventory(lead_time=8,
                                                  reorder_point=10,
                                                  reorder_quantity=30,
                                                  max_capacity=100)
         self.machine1 = Machine(max_production_rate=10,
-                                mttf=80, mttr=20, defect_rate=0.05)
+                                mttf=80, mttr=20, defect_rate=0.05, rng=m1_rng,
+                                antithetic=antithetic)
         self.machine2 = Machine(max_production_rate=8,
-                                mttf=75, mttr=10, defect_rate=0.03)
+                                mttf=75, mttr=10, defect_rate=0.03, rng=m2_rng,
+                                antithetic=antithetic)
         self.buffer = Buffer(holding_cost=1, max_capacity=50)
         self.produced_goods = ProducedGoods(holding_cost=3,
                                             max_capacity=100, selling_cost=10)
@@ -113,22 +355,122 @@ class SimulationEnvironment:
         self.demand_std = 2
         self.accumulated_demand = 0
         self.accumulated_fulfilled_demand = 0
+        self.kpis = None
 
-    def step(self):
-        """Advance the simulation by one time step."""
-        demand = max(0, int(np.random.normal(self.demand_mean, self.demand_std)))
+    def track_kpis(self, batch_size=100):
+        """Start accumulating the KPIs of the following steps of step() and
+        run() in `kpis` (see kpi_statistics.py) and return them."""
+        from kpi_statistics import EnvironmentKPIs
+        self.kpis = EnvironmentKPIs(self, batch_size)
+        return self.kpis
+
+    # Components and their state, everything but the random streams
+    _COMPONENTS = ("raw_material", "machine1", "machine2", "buffer", "produced_goods")
+    _ATTRIBUTES = ("demand_mean", "demand_std", "accumulated_demand",
+                   "accumulated_fulfilled_demand")
+
+    def snapshot(self):
+        """Return the whole state of the simulation, random generators
+        included, as a dict of builtins of a few kilobytes.
+
+        The pre-drawn blocks of the random streams are not stored but drawn
+        again by restore(), so a restored environment continues exactly as
+        this one would. The KPIs of track_kpis() are not part of the state.
+        """
+        return {
+            "components": {name: {slot: getattr(getattr(self, name), slot)
+                                  for slot in type(getattr(self, name)).__slots__
+                                  if slot != "stream"}
+                           for name in self._COMPONENTS},
+            "attributes": {name: getattr(self, name) for name in self._ATTRIBUTES},
+            "rng": _generator_state(self.rng),
+            "streams": {"demand": self.demand_stream.snapshot(),
+                        "machine1": self.machine1.stream.snapshot(),
+                        "machine2": self.machine2.stream.snapshot()},
+        }
+
+    def restore(self, snapshot):
+        """Put the simulation in the state of snapshot(); stop tracking KPIs."""
+        for name, state in snapshot["components"].items():
+            component = getattr(self, name)
+            for slot, value in state.items():
+                setattr(component, slot, value)
+        for name, value in snapshot["attributes"].items():
+            setattr(self, name, value)
+        self.rng = _restore_generator(snapshot["rng"])
+        self.demand_stream = RandomStream.from_snapshot(snapshot["streams"]["demand"])
+        self.machine1.stream = RandomStream.from_snapshot(snapshot["streams"]["machine1"])
+        self.machine2.stream = RandomStream.from_snapshot(snapshot["streams"]["machine2"])
+        self.kpis = None
+        return self
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Create an environment in the state of snapshot()."""
+        return cls().restore(snapshot)
+
+    def reseed(self, rng):
+        """Replace the random streams by new ones split from `rng`, keeping
+        the rest of the state."""
+        self.rng = rng
+        demand_rng, m1_rng, m2_rng = rng.spawn(3)
+        for stream, stream_rng in ((self.demand_stream, demand_rng),
+                                   (self.machine1.stream, m1_rng),
+                                   (self.machine2.stream, m2_rng)):
+            stream.rng = stream_rng
+            stream.block = []
+            stream.index = 0
+            stream.block_state = None
+
+    def fork(self, n, common=False):
+        """Return `n` copies of the current state that continue
+        independently, each with streams split from its own child of `rng`.
+
+        With `common` every copy gets the same streams, so copies whose
+        parameters are then changed see the same demand and machine draws
+        (common random numbers). Copies can be passed to other processes as
+        they are, or as their snapshot().
+        """
+        snapshot = self.snapshot()
+        children = self.rng.spawn(1 if common else n)
+        forks = []
+        for i in range(n):
+            fork = type(self).from_snapshot(snapshot)
+            child = children[0 if common else i]
+            fork.reseed(_restore_generator(_generator_state(child)) if common else child)
+            forks.append(fork)
+        return forks
+
+    def _advance(self, mark=None):
+        """Advance the simulation by one time step and return the fields of
+        TRAJECTORY_DTYPE as a tuple.
+
+        `mark`, if given, is called without arguments at the end of each
+        phase of the step, as listed in simulation_profiler.PHASES.
+        """
+        demand = max(0, int(self.demand_mean + self.demand_std * self.demand_stream.next()))
+        if mark is not None:
+            mark()
         # Raw material consumption
         raw_material_consumed = min(self.raw_material.inventory_on_hand,
                                     self.machine1.production_rate)
         self.raw_material.update(raw_material_consumed)
+        if mark is not None:
+            mark()
 
         # Machine 1 production
         production_m1 = int(self.machine1.operate())
+        if mark is not None:
+            mark()
         self.buffer.add(production_m1)
 
         # Machine 2 production
         available_from_buffer = self.buffer.remove(self.machine2.production_rate)
+        if mark is not None:
+            mark()
         production_m2 = int(min(self.machine2.operate(), available_from_buffer))
+        if mark is not None:
+            mark()
         self.produced_goods.add(production_m2)
 
         # Fulfill demand
@@ -136,11 +478,101 @@ class SimulationEnvironment:
 
         self.accumulated_demand += demand
         self.accumulated_fulfilled_demand += fulfilled_demand
+        if mark is not None:
+            mark()
+
+        return (self.raw_material.inventory_on_hand, production_m1, production_m2,
+                self.buffer.capacity, self.produced_goods.capacity,
+                self.accumulated_demand, self.accumulated_fulfilled_demand,
+                self.machine1.status == "operational",
+                self.machine2.status == "operational")
 
+    def step(self):
+        """Advance the simulation by one time step."""
+        record = self._advance()
+        if self.kpis is not None:
+            self.kpis.add_record(record)
+        (raw_material_level, production_m1, production_m2, buffer_level,
+         produced_goods_level, demand, fulfilled_demand, m1_operational,
+         m2_operational) = record
         return {
-            "raw_material_level": self.raw_material.inventory_on_hand,
+            "raw_material_level": raw_material_level,
             "production_m1": production_m1,
             "production_m2": production_m2,
+            "buffer_level": buffer_level,
+            "produced_goods_level": produced_goods_level,
+            "demand": demand,
+            "fulfilled_demand": fulfilled_demand,
+            "m1_status": 1 if m1_operational else 0,
+            "m2_status": 1 if m2_operational else 0,
+        }
+
+    def run(self, n_steps, out=None):
+        """Advance the simulation by `n_steps` time steps and return the
+        trajectory as a structured array of TRAJECTORY_DTYPE.
+
+        The records are written into `out` when given, so a caller can reuse
+        the same preallocated array across calls.
+        """
+        if out is None:
+            out = np.empty(n_steps, dtype=TRAJECTORY_DTYPE)
+        else:
+            out = out[:n_steps]
+        advance = self._advance
+        for i in range(n_steps):
+            out[i] = advance()
+        if self.kpis is not None:
+            self.kpis.add_trajectory(out)
+        return out
+
+    def advance(self, steps):
+        """Event-skipping equivalent of calling step() `steps` times.
+
+        Machine failures, repairs and raw material deliveries are sampled as
+        events and the steps in between are not simulated one by one. Returns
+        the same fields as step(), with production_m1 and production_m2 being
+        the totals over the advanced steps. The steps are not recorded in the
+        KPIs of track_kpis(), so advancing while they are tracked is an error.
+        """
+        if self.kpis is not None:
+            raise RuntimeError("advance() does not record KPIs; use run() while tracking them")
+        self.raw_material.advance(steps, self.machine1.production_rate)
+        m1_periods = self.machine1.advance(steps)
+        m2_periods = self.machine2.advance(steps)
+        production_m1 = np.trunc(self.machine1.output_per_step(m1_periods, steps))
+        m2_output = self.machine2.output_per_step(m2_periods, steps)
+        demand = np.maximum(0, np.trunc(
+            self.demand_mean + self.demand_std * self.demand_stream.draw(steps)))
+
+        # Buffer: add production of machine 1, then machine 2 takes its rate
+        removal = self.machine2.production_rate
+        buffer_levels = _clamped_walk(
+            self.buffer.capacity, production_m1 - removal,
+            np.full(steps, max(self.buffer.max_capacity - removal, 0)))
+        previous_levels = np.concatenate(([self.buffer.capacity], buffer_levels[:-1]))
+        available_from_buffer = np.minimum(
+            removal, np.minimum(previous_levels + production_m1, self.buffer.max_capacity))
+        production_m2 = np.trunc(np.minimum(m2_output, available_from_buffer))
+
+        # Produced goods: add production of machine 2, then fulfill demand
+        max_capacity = self.produced_goods.max_capacity
+        goods_levels = _clamped_walk(
+            self.produced_goods.capacity, production_m2 - demand,
+            np.maximum(max_capacity - demand, 0))
+        previous_levels = np.concatenate(([self.produced_goods.capacity], goods_levels[:-1]))
+        fulfilled_demand = np.minimum(
+            demand, np.minimum(previous_levels + production_m2, max_capacity))
+
+        if steps > 0:
+            self.buffer.capacity = buffer_levels[-1].item()
+            self.produced_goods.capacity = goods_levels[-1].item()
+        self.accumulated_demand += demand.sum().item()
+        self.accumulated_fulfilled_demand += fulfilled_demand.sum().item()
+
+        return {
+            "raw_material_level": self.raw_material.inventory_on_hand,
+            "production_m1": production_m1.sum().item(),
+            "production_m2": production_m2.sum().item(),
             "buffer_level": self.buffer.capacity,
             "produced_goods_level": self.produced_goods.capacity,
             "demand": self.accumulated_demand,
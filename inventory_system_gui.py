@@ -1,9 +1,13 @@
 """Graphical User Interface for the Inventory System Simulation"""
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import ttk
 import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
+from dashboard_plot import DashboardPlot, TrajectoryHistory
 from inventory_system import SimulationEnvironment
 
 class SimulationUI:
@@ -12,15 +16,16 @@ class SimulationUI:
         self.master = master
         self.master.title("Manufacturing Simulation")
         self.simulation = SimulationEnvironment()
-        self.history = {
-            'raw_material_level': [],
-            'production_m1': [],
-            'production_m2': [],
-            'buffer_level': [],
-            'produced_goods_level': [],
-            'demand': [],
-            'fulfilled_demand': []
-        }
+        # Live mode: a worker thread runs the simulation and hands the
+        # trajectory over to the Tk thread in batches
+        self.simulation_lock = threading.Lock()
+        self.live_queue = queue.Queue(maxsize=64)
+        self.live_stop = threading.Event()
+        self.live_worker = None
+        self.live_steps_per_second = 120
+        self.max_fps = 60
+        # One year of hourly steps
+        self.history = TrajectoryHistory(capacity=24 * 365)
         self.create_widgets()
         self.create_plot()
 
@@ -130,6 +135,8 @@ class SimulationUI:
         self.demand_std.grid(row=10, column=1, padx=5, pady=2)
         
         ttk.Button(self.master, text="Update", command=self.update_simulation).grid(row=11, column=0, columnspan=2, pady=10)
+        self.live = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.master, text="Live", variable=self.live, command=self.toggle_live).grid(row=11, column=2, columnspan=2, pady=10)
         
         # Create canvas for machine and buffer visualization
         self.canvas = tk.Canvas(self.master, width=550, height=370)
@@ -141,10 +148,12 @@ class SimulationUI:
         self.canvas_plot = FigureCanvasTkAgg(self.fig, master=self.master)
         self.canvas_plot_widget = self.canvas_plot.get_tk_widget()
         self.canvas_plot_widget.grid(row=0, column=5, rowspan=16, columnspan=2, padx=3, pady=3)
+        self.toolbar = NavigationToolbar2Tk(self.canvas_plot, self.master, pack_toolbar=False)
+        self.toolbar.grid(row=16, column=5, columnspan=2, sticky="w")
+        self.dashboard = DashboardPlot(self.fig, self.ax, max_fps=self.max_fps)
 
-        
-    def update_simulation(self):
-        # Update simulation parameters
+    def apply_parameters(self):
+        """Copy the parameters from the entries to the simulation"""
         self.simulation.raw_material.lead_time = float(self.raw_lead_time.get())
         self.simulation.raw_material.max_capacity = float(self.raw_max_capacity.get())
         #self.simulation.raw_material.holding_cost = float(self.raw_holding_cost.get())
@@ -163,57 +172,73 @@ class SimulationUI:
         self.simulation.demand_mean = float(self.demand_mean.get())
         self.simulation.demand_std = float(self.demand_std.get())
 
-        # Run simulation for 100 steps
-        for _ in range(48):
-            state = self.simulation.step()
-            self.history['raw_material_level'].append(state['raw_material_level'])
-            self.history['production_m1'].append(state['production_m1'])
-            self.history['production_m2'].append(state['production_m2'])
-            self.history['buffer_level'].append(state['buffer_level'])
-            self.history['produced_goods_level'].append(state['produced_goods_level'])
-            self.history['demand'].append(state['demand'])
-            self.history['fulfilled_demand'].append(state['fulfilled_demand'])
+    def update_simulation(self):
+        with self.simulation_lock:
+            self.apply_parameters()
+        self.dashboard.follow_latest()
+        if self.live.get():
+            return
+
+        # Run simulation for 48 steps
+        self.history.extend(self.simulation.run(48))
         
         self.update_plot()
         self.update_visualization()
+
+    def toggle_live(self):
+        """Start or stop the live simulation"""
+        if self.live.get():
+            self.live_stop.clear()
+            self.dashboard.follow_latest()
+            self.live_worker = threading.Thread(target=self.run_live_worker, daemon=True)
+            self.live_worker.start()
+            self.poll_live()
+        else:
+            self.live_stop.set()
+            self.live_worker.join()
+            self.live_worker = None
+
+    def run_live_worker(self):
+        """Simulate at `live_steps_per_second` and queue the trajectory in
+        batches, until live mode is stopped"""
+        start = time.monotonic()
+        simulated = 0
+        while not self.live_stop.is_set():
+            due = int((time.monotonic() - start) * self.live_steps_per_second) - simulated
+            if due <= 0:
+                time.sleep(1 / self.max_fps)
+                continue
+            with self.simulation_lock:
+                trajectory = self.simulation.run(due)
+            simulated += due
+            while not self.live_stop.is_set():
+                try:
+                    self.live_queue.put(trajectory, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def poll_live(self):
+        """Plot the batches queued by the live worker, at most `max_fps`
+        times per second"""
+        if not self.live.get():
+            return
+        received = False
+        while True:
+            try:
+                trajectory = self.live_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.history.extend(trajectory)
+            received = True
+        if received:
+            self.dashboard.set_data(self.history)
+            with self.simulation_lock:
+                self.update_visualization()
+        self.master.after(int(1000 / self.max_fps), self.poll_live)
         
     def update_plot(self):
-        self.ax[0].clear()
-        self.ax[0].plot(self.history['demand'], label="Accumulated Demand")
-        self.ax[0].plot(self.history['fulfilled_demand'], label="Accumulated Fulfilled Demand")
-        self.ax[0].legend()
-        #self.ax[0].set_title("Demand vs Fulfilled Demand")
-        self.ax[0].set_ylabel("Demand")
-
-        self.ax[1].clear()
-        self.ax[1].plot(self.history['raw_material_level'], label="Raw Material")
-        self.ax[1].plot(self.history['buffer_level'], label="Buffer")
-        self.ax[1].plot(self.history['produced_goods_level'], label="Produced Goods")
-        self.ax[1].legend()
-        #self.ax[1].set_title("Inventory Levels")
-        self.ax[1].set_ylabel("Inventory Level")
-
-        self.ax[2].clear()
-        self.ax[2].plot(self.history['production_m1'], label="Machine 1")
-        self.ax[2].plot(self.history['production_m2'], label="Machine 2")
-        self.ax[2].legend()
-        #self.ax[2].set_title("Production Rate")
-        self.ax[2].set_xlabel("Time")
-        self.ax[2].set_ylabel("Production Rate")
-        self.fig.canvas.draw()
-
-        # Clear all history
-        self.simulation.accumulated_demand = 0
-        self.simulation.accumulated_fulfilled_demand = 0
-        self.history = {
-            'raw_material_level': [],
-            'production_m1': [],
-            'production_m2': [],
-            'buffer_level': [],
-            'produced_goods_level': [],
-            'demand': [],
-            'fulfilled_demand': []
-        }
+        self.dashboard.set_data(self.history, force=True)
         
     def update_visualization(self):
         self.canvas.delete("all")
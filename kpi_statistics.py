@@ -0,0 +1,289 @@
+"""
+Streaming KPIs of a simulation and replications until they are precise enough.
+
+    env = SimulationEnvironment(seed=0)
+    kpis = env.track_kpis(batch_size=100)
+    env.run(10_000)
+    kpis.summary()   # {'fill_rate': {'mean': ..., 'half_width': ..., ...}, ...}
+
+The KPIs are updated by SimulationEnvironment.step() and run() as the
+simulation goes, in constant memory: running means and variances (Welford)
+and batch means, whose spread gives a confidence interval within one long
+run. replicate_until() runs independent replications until the confidence
+interval of every requested KPI is narrow enough, instead of a fixed number.
+"""
+import argparse
+import math
+import numpy as np
+from inventory_system import TRAJECTORY_DTYPE
+
+def t_quantile(confidence, degrees_of_freedom):
+    """Two-sided quantile of Student's t distribution (scipy), or of the
+    normal distribution if scipy is not installed."""
+    probability = 0.5 + confidence / 2
+    try:
+        from scipy.stats import t
+    except ImportError:
+        from statistics import NormalDist
+        return NormalDist().inv_cdf(probability)
+    return float(t.ppf(probability, degrees_of_freedom))
+
+class RunningStatistic:
+    """Count, mean and variance of a stream of values (Welford)."""
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        """Add one value."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def add_many(self, values):
+        """Add an array of values, merging its statistics at once (Chan)."""
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        count = self.count + len(values)
+        mean = values.mean()
+        delta = mean - self.mean
+        self.m2 += ((values - mean) ** 2).sum() + delta ** 2 * self.count * len(values) / count
+        self.mean += delta * len(values) / count
+        self.count = count
+
+    @property
+    def variance(self):
+        """Sample variance, nan with fewer than two values."""
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def half_width(self, confidence=0.95):
+        """Half-width of the confidence interval of the mean, inf with fewer
+        than two values."""
+        if self.count < 2:
+            return math.inf
+        return t_quantile(confidence, self.count - 1) * self.std / math.sqrt(self.count)
+
+class BatchMeans:
+    """Mean of a stream of values per step, with its confidence interval
+    from the means of consecutive batches of `batch_size` steps.
+
+    With `weights` the statistic is the ratio sum(values) / sum(weights),
+    e.g. the fill rate with the fulfilled demand as values and the demand as
+    weights, and each batch gives the ratio of its own sums. Batches without
+    any weight are left out of the interval.
+    """
+    __slots__ = ("batch_size", "batches", "total", "total_weight", "steps",
+                 "batch_total", "batch_weight", "batch_steps")
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.batches = RunningStatistic()
+        self.total = 0.0
+        self.total_weight = 0.0
+        self.steps = 0
+        self.batch_total = 0.0
+        self.batch_weight = 0.0
+        self.batch_steps = 0
+
+    def _close_batch(self):
+        if self.batch_weight:
+            self.batches.add(self.batch_total / self.batch_weight)
+        self.batch_total = self.batch_weight = 0.0
+        self.batch_steps = 0
+
+    def add(self, value, weight=1.0):
+        """Add the value of one step."""
+        self.total += value
+        self.total_weight += weight
+        self.steps += 1
+        self.batch_total += value
+        self.batch_weight += weight
+        self.batch_steps += 1
+        if self.batch_steps == self.batch_size:
+            self._close_batch()
+
+    def add_many(self, values, weights=None):
+        """Add the values of consecutive steps."""
+        values = np.asarray(values, dtype=float)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float)
+        self.total += values.sum()
+        self.total_weight += weights.sum()
+        self.steps += len(values)
+        # Complete the current batch, then whole batches at once
+        head = min(self.batch_size - self.batch_steps, len(values))
+        self.batch_total += values[:head].sum()
+        self.batch_weight += weights[:head].sum()
+        self.batch_steps += head
+        if self.batch_steps < self.batch_size:
+            return
+        self._close_batch()
+        n_batches = (len(values) - head) // self.batch_size
+        end = head + n_batches * self.batch_size
+        totals = values[head:end].reshape(n_batches, self.batch_size).sum(axis=1)
+        batch_weights = weights[head:end].reshape(n_batches, self.batch_size).sum(axis=1)
+        self.batches.add_many(totals[batch_weights != 0] / batch_weights[batch_weights != 0])
+        self.batch_total = values[end:].sum()
+        self.batch_weight = weights[end:].sum()
+        self.batch_steps = len(values) - end
+
+    @property
+    def mean(self):
+        return self.total / self.total_weight if self.total_weight else math.nan
+
+    def half_width(self, confidence=0.95):
+        """Batch-means half-width of the confidence interval of the mean."""
+        return self.batches.half_width(confidence)
+
+# KPI: (value field, weight field or None); the demands are per step
+KPIS = {
+    "fill_rate": ("fulfilled_demand", "demand"),
+    "throughput": ("production_m2", None),
+    "production_m1": ("production_m1", None),
+    "m1_availability": ("m1_status", None),
+    "m2_availability": ("m2_status", None),
+    "raw_material_level": ("raw_material_level", None),
+    "buffer_level": ("buffer_level", None),
+    "produced_goods_level": ("produced_goods_level", None),
+    "demand": ("demand", None),
+}
+
+class EnvironmentKPIs:
+    """Batch means of the KPIS of a SimulationEnvironment, fed with its
+    records by step() and run()."""
+    def __init__(self, env, batch_size=100):
+        self.batch_size = batch_size
+        self.statistics = {name: BatchMeans(batch_size) for name in KPIS}
+        self.accumulated_demand = env.accumulated_demand
+        self.accumulated_fulfilled_demand = env.accumulated_fulfilled_demand
+        self._fields = {name: TRAJECTORY_DTYPE.names.index(name)
+                        for name in TRAJECTORY_DTYPE.names}
+
+    def reset(self, env):
+        """Forget the steps so far, e.g. after a warm-up."""
+        self.__init__(env, self.batch_size)
+
+    def add_record(self, record):
+        """Add one step given as a tuple in TRAJECTORY_DTYPE order."""
+        values = {name: record[index] for name, index in self._fields.items()}
+        values["demand"], self.accumulated_demand = (
+            values["demand"] - self.accumulated_demand, values["demand"])
+        values["fulfilled_demand"], self.accumulated_fulfilled_demand = (
+            values["fulfilled_demand"] - self.accumulated_fulfilled_demand,
+            values["fulfilled_demand"])
+        for name, (value, weight) in KPIS.items():
+            self.statistics[name].add(values[value], 1.0 if weight is None else values[weight])
+
+    def add_trajectory(self, trajectory):
+        """Add the steps of a structured array of TRAJECTORY_DTYPE."""
+        if len(trajectory) == 0:
+            return
+        values = {name: trajectory[name] for name in TRAJECTORY_DTYPE.names}
+        values["demand"] = np.diff(trajectory["demand"], prepend=self.accumulated_demand)
+        values["fulfilled_demand"] = np.diff(trajectory["fulfilled_demand"],
+                                             prepend=self.accumulated_fulfilled_demand)
+        self.accumulated_demand = trajectory["demand"][-1].item()
+        self.accumulated_fulfilled_demand = trajectory["fulfilled_demand"][-1].item()
+        for name, (value, weight) in KPIS.items():
+            self.statistics[name].add_many(values[value], None if weight is None else values[weight])
+
+    @property
+    def steps(self):
+        return self.statistics["throughput"].steps
+
+    def means(self):
+        """Return the mean of every KPI."""
+        return {name: statistic.mean for name, statistic in self.statistics.items()}
+
+    def summary(self, confidence=0.95):
+        """Return the mean, batch-means half-width and number of batches of
+        every KPI."""
+        return {name: {"mean": statistic.mean,
+                       "half_width": statistic.half_width(confidence),
+                       "batches": statistic.batches.count}
+                for name, statistic in self.statistics.items()}
+
+def simulate_replication(seed_sequence, horizon=24 * 90, warmup=24 * 7, scenario=None,
+                         antithetic=False):
+    """Simulate one replication and return the mean of every KPI over the
+    `horizon` steps after the first `warmup`."""
+    from inventory_data_generator import apply_scenario
+    from inventory_system import SimulationEnvironment
+    env = SimulationEnvironment(seed=seed_sequence, antithetic=antithetic)
+    if scenario:
+        apply_scenario(env, scenario)
+    env.run(warmup)
+    kpis = env.track_kpis()
+    env.run(horizon)
+    return kpis.means()
+
+def replicate_until(targets, simulate=simulate_replication, confidence=0.95, relative=False,
+                    min_replications=5, max_replications=1000, seed=None, **options):
+    """Run replications until every KPI of `targets` has a confidence
+    interval half-width at most its target.
+
+    `targets` maps KPI names to half-widths, relative to the mean if
+    `relative`. `simulate(seed_sequence, **options)` returns the KPIs of one
+    replication, simulate_replication() by default. At least
+    `min_replications` and at most `max_replications` are run. Returns the
+    mean, half-width and number of replications of every KPI, and whether
+    all the targets were met.
+    """
+    seed_sequences = np.random.SeedSequence(seed).spawn(max_replications)
+    statistics = {}
+    converged = False
+    for replications, seed_sequence in enumerate(seed_sequences, 1):
+        for name, value in simulate(seed_sequence, **options).items():
+            statistics.setdefault(name, RunningStatistic()).add(value)
+        if replications < min_replications:
+            continue
+        converged = all(
+            statistics[name].half_width(confidence)
+            <= target * (abs(statistics[name].mean) if relative else 1)
+            for name, target in targets.items())
+        if converged:
+            break
+    return {
+        "kpis": {name: {"mean": statistic.mean,
+                        "half_width": statistic.half_width(confidence),
+                        "replications": statistic.count}
+                 for name, statistic in statistics.items()},
+        "converged": converged,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', default=[], metavar='KPI=HALF_WIDTH',
+                        help=f"e.g. fill_rate=0.005; KPIs: {', '.join(KPIS)}")
+    parser.add_argument('--relative', action='store_true',
+                        help='half-widths are relative to the means')
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--horizon', type=int, default=24 * 90)
+    parser.add_argument('--warmup', type=int, default=24 * 7)
+    parser.add_argument('--max-replications', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    targets = dict(target.split('=') for target in args.target) or {'fill_rate': '0.005'}
+    unknown = set(targets) - set(KPIS)
+    if unknown:
+        parser.error(f"Unknown KPIs: {', '.join(sorted(unknown))}")
+    results = replicate_until({name: float(value) for name, value in targets.items()},
+                              confidence=args.confidence, relative=args.relative,
+                              max_replications=args.max_replications, seed=args.seed,
+                              horizon=args.horizon, warmup=args.warmup)
+    replications = next(iter(results['kpis'].values()))['replications']
+    print(f"{replications} replications, "
+          f"{'targets met' if results['converged'] else 'targets not met'}")
+    for name, kpi in results['kpis'].items():
+        marker = '*' if name in targets else ' '
+        print(f"{marker} {name:>22}: {kpi['mean']:.4f} +/- {kpi['half_width']:.4f}")
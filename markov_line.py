@@ -0,0 +1,234 @@
+"""
+Exact steady state of the Machine -> Buffer -> Machine line of
+inventory_system.py as a discrete-time Markov chain, instead of simulating it.
+
+The state at the end of a step is the buffer level, the status of both
+machines and, for the fill rate, the level of the produced goods. The
+transitions follow SimulationEnvironment.step() exactly: a machine fails
+with probability 1/mttf and is repaired with probability 1/mttr per step,
+and the demand is max(0, int(x)) with x normally distributed. The raw
+material never stops machine 1, so it is not part of the state.
+
+Without the produced goods the chain has a few hundred states and is solved
+in milliseconds, fast enough to sweep thousands of configurations; with them
+it has tens of thousands and takes a second or two.
+"""
+import argparse
+import math
+import numpy as np
+
+def _outcomes(machine):
+    """Return (probability, producing, next operational) of the two outcomes
+    of a step for each status, indexed [status][outcome]."""
+    failure = min(1 / machine.mttf, 1.0)
+    repair = min(1 / machine.mttr, 1.0)
+    return (
+        # Failed: repaired or not, never producing
+        ((repair, False, True), (1 - repair, False, False)),
+        # Operational: keeps producing or fails, producing nothing
+        ((1 - failure, True, True), (failure, False, False)),
+    )
+
+def demand_distribution(mean, std, sigmas=6):
+    """Return the values and probabilities of max(0, int(x)) for x normal,
+    the demand of SimulationEnvironment.step(); the tail beyond `sigmas`
+    standard deviations is added to the largest value."""
+    if std <= 0:
+        return np.array([max(0, int(mean))], dtype=float), np.ones(1)
+    def cdf(x):
+        return 0.5 * (1 + math.erf((x - mean) / (std * math.sqrt(2))))
+    largest = max(1, int(mean + sigmas * std))
+    # int() truncates towards zero, so every x < 1 gives a demand of 0
+    edges = [cdf(k) for k in range(1, largest + 1)]
+    probabilities = np.diff([0.0] + edges + [1.0])
+    return np.arange(largest + 1, dtype=float), probabilities
+
+def _reachable(start, successors, limit=100_000):
+    """Return the sorted set of values reachable from `start`."""
+    seen = {start}
+    frontier = [start]
+    while frontier:
+        value = frontier.pop()
+        for successor in successors(value):
+            if successor not in seen:
+                seen.add(successor)
+                frontier.append(successor)
+                if len(seen) > limit:
+                    raise ValueError("The state space is too large")
+    return np.array(sorted(seen))
+
+def _stationary(rows, columns, probabilities, n_states, tolerance=1e-13):
+    """Stationary distribution of the transition matrix given as triplets.
+
+    Small chains are solved directly. Large ones, where a sparse LU
+    factorization fills in badly, by power iteration, with a scipy sparse
+    matrix if scipy is installed.
+    """
+    if n_states <= 1000:
+        matrix = np.zeros((n_states, n_states))
+        np.add.at(matrix, (columns, rows), probabilities)
+        matrix -= np.eye(n_states)
+        # Replace one balance equation by the normalization
+        matrix[0] = 1
+        rhs = np.zeros(n_states)
+        rhs[0] = 1
+        distribution = np.linalg.solve(matrix, rhs)
+    else:
+        try:
+            import scipy.sparse
+        except ImportError:
+            def step(distribution):
+                return np.bincount(columns, distribution[rows] * probabilities,
+                                   minlength=n_states)
+        else:
+            step = scipy.sparse.csr_matrix((probabilities, (columns, rows)),
+                                           shape=(n_states, n_states)).dot
+        distribution = np.full(n_states, 1 / n_states)
+        for _ in range(100_000):
+            updated = step(distribution)
+            converged = np.abs(updated - distribution).sum() < tolerance
+            distribution = updated
+            if converged:
+                break
+    distribution = np.maximum(distribution, 0)
+    return distribution / distribution.sum()
+
+def solve_line(machine1, machine2, buffer, produced_goods=None, demand_mean=7,
+               demand_std=2):
+    """Steady state of two machines with a buffer between them.
+
+    `machine1`, `machine2`, `buffer` and `produced_goods` are the components
+    of inventory_system.py (or anything with the same attributes). Without
+    `produced_goods` the chain only covers the machines and the buffer and
+    the fill rate is not computed. Returns a dict with the mean production of
+    each machine per step (`throughput` is the one of machine 2), the
+    distribution of the buffer level, the probabilities that machine 2 is
+    starved (operating but short of material) and that machine 1 is blocked
+    (part of its output does not fit in the buffer), the availability of the
+    machines and, with `produced_goods`, the fill rate and mean level of the
+    produced goods.
+    """
+    output1 = float(int(machine1.production_rate * (1 - machine1.defect_rate)))
+    rate2 = machine2.production_rate
+    capacity2 = machine2.production_rate * (1 - machine2.defect_rate)
+    buffer_capacity = buffer.max_capacity
+
+    def buffer_step(level, produced):
+        level = min(level + (output1 if produced else 0.0), buffer_capacity)
+        taken = min(rate2, level)
+        return level - taken, taken
+
+    buffer_levels = _reachable(0.0, lambda level: {buffer_step(level, produced)[0]
+                                                   for produced in (False, True)})
+    outputs2 = {float(int(min(capacity2, buffer_step(level, produced)[1])))
+                for level in buffer_levels for produced in (False, True)} | {0.0}
+    if produced_goods is not None:
+        demands, demand_probabilities = demand_distribution(demand_mean, demand_std)
+        goods_capacity = produced_goods.max_capacity
+
+        def goods_step(level):
+            for output in outputs2:
+                stocked = min(level + output, goods_capacity)
+                for demand in demands:
+                    yield stocked - min(demand, stocked)
+        goods_levels = _reachable(0.0, lambda level: set(goods_step(level)))
+    else:
+        demands, demand_probabilities = np.zeros(1), np.ones(1)
+        goods_capacity = 0.0
+        goods_levels = np.zeros(1)
+
+    # State index: ((buffer * n_goods + goods) * 2 + status1) * 2 + status2
+    n_buffer, n_goods = len(buffer_levels), len(goods_levels)
+    n_states = n_buffer * n_goods * 4
+    index = np.arange(n_states)
+    status2 = index % 2
+    status1 = index // 2 % 2
+    goods = goods_levels[index // 4 % n_goods]
+    level = buffer_levels[index // (4 * n_goods)]
+    outcomes1, outcomes2 = _outcomes(machine1), _outcomes(machine2)
+
+    columns_list, probabilities_list, kpis = [], [], []
+    for outcome1 in range(2):
+        for outcome2 in range(2):
+            probability1, producing1, next1 = (np.array(values)[status1] for values in
+                                               zip(*(outcomes1[s][outcome1] for s in range(2))))
+            probability2, producing2, next2 = (np.array(values)[status2] for values in
+                                               zip(*(outcomes2[s][outcome2] for s in range(2))))
+            arrived = np.where(producing1, output1, 0.0)
+            stocked = np.minimum(level + arrived, buffer_capacity)
+            taken = np.minimum(rate2, stocked)
+            output = np.where(producing2, np.trunc(np.minimum(capacity2, taken)), 0.0)
+            next_level = np.searchsorted(buffer_levels, stocked - taken)
+            goods_stocked = np.minimum(goods + output, goods_capacity)
+            for demand, demand_probability in zip(demands, demand_probabilities):
+                fulfilled = np.minimum(demand, goods_stocked)
+                next_goods = np.searchsorted(goods_levels, goods_stocked - fulfilled)
+                columns_list.append(((next_level * n_goods + next_goods) * 2 + next1) * 2 + next2)
+                probabilities_list.append(probability1 * probability2 * demand_probability)
+                kpis.append({
+                    "production_m1": arrived, "production_m2": output,
+                    "starved": producing2 & (taken < capacity2),
+                    "blocked": producing1 & (level + arrived > buffer_capacity),
+                    "demand": np.full(n_states, demand), "fulfilled_demand": fulfilled,
+                })
+    rows = np.tile(index, len(columns_list))
+    columns = np.concatenate(columns_list)
+    probabilities = np.concatenate(probabilities_list)
+    distribution = _stationary(rows, columns, probabilities, n_states)
+
+    weights = distribution[rows] * probabilities
+    def expectation(key):
+        return float(weights @ np.concatenate([kpi[key] for kpi in kpis]))
+
+    buffer_distribution = distribution.reshape(n_buffer, n_goods * 4).sum(axis=1)
+    results = {
+        "throughput": expectation("production_m2"),
+        "production_m1": expectation("production_m1"),
+        "production_m2": expectation("production_m2"),
+        "buffer_levels": buffer_levels,
+        "buffer_distribution": buffer_distribution,
+        "mean_buffer_level": float(buffer_levels @ buffer_distribution),
+        "starvation_probability": expectation("starved"),
+        "blocking_probability": expectation("blocked"),
+        "m1_availability": float(distribution[status1 == 1].sum()),
+        "m2_availability": float(distribution[status2 == 1].sum()),
+        "n_states": n_states,
+    }
+    if produced_goods is not None:
+        goods_distribution = distribution.reshape(n_buffer, n_goods, 4).sum(axis=(0, 2))
+        results["fill_rate"] = expectation("fulfilled_demand") / expectation("demand")
+        results["mean_produced_goods_level"] = float(goods_levels @ goods_distribution)
+    return results
+
+def solve_environment(env, fill_rate=True):
+    """solve_line() with the components and demand of a SimulationEnvironment."""
+    return solve_line(env.machine1, env.machine2, env.buffer,
+                      env.produced_goods if fill_rate else None,
+                      env.demand_mean, env.demand_std)
+
+
+if __name__ == "__main__":
+    import time
+    from inventory_system import SimulationEnvironment
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--simulate', type=int, default=0,
+                        help='also simulate this many steps to compare')
+    parser.add_argument('--no-fill-rate', action='store_true',
+                        help='leave the produced goods out of the chain')
+    args = parser.parse_args()
+    env = SimulationEnvironment(seed=0)
+    start = time.perf_counter()
+    results = solve_environment(env, fill_rate=not args.no_fill_rate)
+    elapsed = time.perf_counter() - start
+    print(f"{results['n_states']} states solved in {1000 * elapsed:.1f} ms")
+    for key, value in results.items():
+        if np.isscalar(value) and key != "n_states":
+            print(f"{key:>26}: {value:.4f}")
+    if args.simulate:
+        trajectory = env.run(args.simulate)
+        print("Simulated:")
+        print(f"{'production_m1':>26}: {trajectory['production_m1'].mean():.4f}")
+        print(f"{'production_m2':>26}: {trajectory['production_m2'].mean():.4f}")
+        print(f"{'mean_buffer_level':>26}: {trajectory['buffer_level'].mean():.4f}")
+        print(f"{'fill_rate':>26}: {env.accumulated_fulfilled_demand / env.accumulated_demand:.4f}")
+        print(f"{'mean_produced_goods_level':>26}: {trajectory['produced_goods_level'].mean():.4f}")
@@ -1,128 +1,417 @@
-import pandas as pd
-import numpy as np
-import tensorflow as tf
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import MinMaxScaler
-import matplotlib.pyplot as plt
-from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
+"""
+Training pipeline of the LSTM surrogate of the inventory system simulation.
 
-# Load and prepare data
-data = pd.read_csv('inventory_data.csv')
+The stages can be used on their own: load_data(), preprocess() (scaling,
+cached on disk), make_datasets() (windowing), build_model(), train() and
+evaluate(). main_streaming() trains on scenarios simulated on the fly
+instead of a generated data file. TensorFlow, scikit-learn, pandas and
+matplotlib are only imported by the stages that need them.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from windowed_dataset import WindowedDataset, infer_scenario_id
 
 # Define features
-input_features = [
+INPUT_FEATURES = [
     'buffer_level', 'produced_goods_level', 'demand', 'fulfilled_demand',
-    'lead_time', 'inventory_max_capacity', 'inventory_position', 
+    'lead_time', 'inventory_max_capacity', 'inventory_position',
     'inventory_on_hand', 'm1_max_production_rate', 'm1_mttf', 'm1_mttr',
     'm1_defect_rate', 'm2_max_production_rate', 'm2_mttf', 'm2_mttr',
     'm2_defect_rate', 'buffer_max_capacity', 'produced_goods_max_capacity'
 ]
 
-output_features = [
-    'm1_production', 'm2_production', 'reorder_point', 
+OUTPUT_FEATURES = [
+    'm1_production', 'm2_production', 'reorder_point',
     'reorder_quantity', 'm1_downtime', 'm2_downtime'
 ]
 
-X = data[input_features]
-Y = data[output_features]
+DEFAULT_CONFIG = {
+    'input_features': INPUT_FEATURES,
+    'output_features': OUTPUT_FEATURES,
+    'time_steps': 10,
+    # Split data with temporal consideration
+    'train_fraction': 0.8,
+    'validation_split': 0.2,
+}
+
+# Bump when the layout of the cached preprocessing artifacts changes
+CACHE_VERSION = 1
+
+def default_source():
+    """The columnar dataset if one was generated, the CSV file otherwise."""
+    return 'inventory_data' if os.path.isdir('inventory_data') else 'inventory_data.csv'
+
+def load_columnar_features(data, names, chunk_size=1_000_000):
+    """Gather `names` from a columnar dataset into a memory-mapped matrix."""
+    from inventory_data_generator import feature_column
+    trajectory, parameters = data['trajectory'], data['parameters']
+    scenario_id = data['scenario_id']
+    features = np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode='w+',
+                         shape=(len(trajectory), len(names)))
+    for start in range(0, len(trajectory), chunk_size):
+        rows = slice(start, start + chunk_size)
+        for j, name in enumerate(names):
+            table, index = feature_column(name, data['columns'])
+            if table == 'trajectory':
+                features[rows, j] = trajectory[rows, index]
+            else:
+                features[rows, j] = parameters[:, index][scenario_id[rows]]
+    return features
+
+def load_data(source, input_features=INPUT_FEATURES, output_features=OUTPUT_FEATURES):
+    """Load the inputs, outputs and scenario id of every row of a CSV file or
+    a columnar dataset directory."""
+    if os.path.isdir(source):
+        from inventory_data_generator import load_columnar
+        columnar_data = load_columnar(source)
+        X = load_columnar_features(columnar_data, input_features)
+        Y = load_columnar_features(columnar_data, output_features)
+        return X, Y, columnar_data['scenario_id']
+    import pandas as pd
+    from inventory_data_generator import CSV_COLUMNS, FEATURE_ALIASES, PARAMETER_COLUMNS
+    data = pd.read_csv(source, header=0, names=CSV_COLUMNS)
+    scenario_id = infer_scenario_id(data[PARAMETER_COLUMNS].to_numpy())
+
+    def select(names):
+        return data[[FEATURE_ALIASES.get(name, name) for name in names]].to_numpy()
+    return select(input_features), select(output_features), scenario_id
+
+def fit_scaler(values, chunk_size=1_000_000):
+    """Fit a MinMaxScaler chunk by chunk."""
+    from sklearn.preprocessing import MinMaxScaler
+    scaler = MinMaxScaler()
+    for start in range(0, len(values), chunk_size):
+        scaler.partial_fit(values[start:start + chunk_size])
+    return scaler
+
+def set_scaler_ranges(scaler, names, ranges):
+    """Replace the data range fitted by a MinMaxScaler for the features
+    `names` found in `ranges`, a dict of (low, high)."""
+    for j, name in enumerate(names):
+        if name in ranges:
+            scaler.data_min_[j], scaler.data_max_[j] = ranges[name]
+    scaler.data_range_ = scaler.data_max_ - scaler.data_min_
+    low, high = scaler.feature_range
+    range_ = np.where(scaler.data_range_ == 0, 1.0, scaler.data_range_)
+    scaler.scale_ = (high - low) / range_
+    scaler.min_ = low - scaler.data_min_ * scaler.scale_
+    return scaler
+
+SCALER_ATTRIBUTES = ['min_', 'scale_', 'data_min_', 'data_max_', 'data_range_', 'n_samples_seen_']
+
+def save_scalers(path, x_scaler, y_scaler):
+    """Save the state of two fitted MinMaxScalers to a .npz file."""
+    arrays = {}
+    for prefix, scaler in (('x_', x_scaler), ('y_', y_scaler)):
+        for attribute in SCALER_ATTRIBUTES:
+            arrays[prefix + attribute] = getattr(scaler, attribute)
+    np.savez(path, **arrays)
+
+def load_scalers(path):
+    """Load the two MinMaxScalers saved by save_scalers()."""
+    from sklearn.preprocessing import MinMaxScaler
+    scalers = []
+    with np.load(path) as data:
+        for prefix in ('x_', 'y_'):
+            scaler = MinMaxScaler()
+            for attribute in SCALER_ATTRIBUTES:
+                setattr(scaler, attribute, data[prefix + attribute])
+            scaler.n_features_in_ = len(scaler.scale_)
+            scalers.append(scaler)
+    return tuple(scalers)
+
+def source_fingerprint(source):
+    """Hash the contents of a data file or of the files of a directory."""
+    digest = hashlib.sha256()
+    paths = ([os.path.join(source, name) for name in sorted(os.listdir(source))]
+             if os.path.isdir(source) else [source])
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(functools.partial(f.read, 1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def _scale_to_file(path, values, scaler, chunk_size=1_000_000):
+    scaled = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=values.shape)
+    for start in range(0, len(values), chunk_size):
+        scaled[start:start + chunk_size] = scaler.transform(values[start:start + chunk_size])
+    scaled.flush()
+
+def preprocess(source=None, config=None, cache_dir='.preprocessing_cache'):
+    """Load and scale the data, reusing the artifacts cached by a previous
+    call on the same data and configuration.
+
+    The scalers are fitted on the training rows only. The artifacts are
+    stored under `cache_dir` in a directory named by a hash of the source
+    data and of the configuration. Returns a dict with the scaled inputs `x`
+    and outputs `y` (memory mapped), the `scenario_id` of every row, the
+    fitted `x_scaler` and `y_scaler`, and the number of training rows
+    `train_size`.
+    """
+    source = source or default_source()
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    key = hashlib.sha256(json.dumps({
+        'version': CACHE_VERSION,
+        'source': source_fingerprint(source),
+        'input_features': config['input_features'],
+        'output_features': config['output_features'],
+        'train_fraction': config['train_fraction'],
+    }, sort_keys=True).encode()).hexdigest()[:16]
+    directory = os.path.join(cache_dir, key)
+    if not os.path.isdir(directory):
+        os.makedirs(cache_dir, exist_ok=True)
+        building = tempfile.mkdtemp(dir=cache_dir)
+        try:
+            X, Y, scenario_id = load_data(source, config['input_features'],
+                                          config['output_features'])
+            train_size = int(len(X) * config['train_fraction'])
+            x_scaler = fit_scaler(X[:train_size])
+            y_scaler = fit_scaler(Y[:train_size])
+            _scale_to_file(os.path.join(building, 'x.npy'), X, x_scaler)
+            _scale_to_file(os.path.join(building, 'y.npy'), Y, y_scaler)
+            np.save(os.path.join(building, 'scenario_id.npy'), scenario_id)
+            save_scalers(os.path.join(building, 'scalers.npz'), x_scaler, y_scaler)
+            # Complete artifacts appear under their final name at once
+            os.replace(building, directory)
+        finally:
+            shutil.rmtree(building, ignore_errors=True)
+    x_scaler, y_scaler = load_scalers(os.path.join(directory, 'scalers.npz'))
+    x = np.load(os.path.join(directory, 'x.npy'), mmap_mode='r')
+    return {
+        'x': x,
+        'y': np.load(os.path.join(directory, 'y.npy'), mmap_mode='r'),
+        'scenario_id': np.load(os.path.join(directory, 'scenario_id.npy'), mmap_mode='r'),
+        'x_scaler': x_scaler,
+        'y_scaler': y_scaler,
+        'train_size': int(len(x) * config['train_fraction']),
+    }
 
-# Split data with temporal consideration
-train_size = int(len(data) * 0.8)
-X_train, X_test = X[:train_size], X[train_size:]
-Y_train, Y_test = Y[:train_size], Y[train_size:]
+def make_datasets(prepared, config=None):
+    """Window the preprocessed data into training, validation and test
+    datasets."""
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    time_steps = config['time_steps']
+    dataset = WindowedDataset(prepared['x'], prepared['y'], prepared['scenario_id'], time_steps)
+    in_train = dataset.starts + time_steps < prepared['train_size']
+    train_dataset, val_dataset = dataset.subset(in_train).split(config['validation_split'])
+    test_dataset = dataset.subset(dataset.starts >= prepared['train_size'])
+    return train_dataset, val_dataset, test_dataset
 
-# Normalize data
-x_scaler = MinMaxScaler()
-y_scaler = MinMaxScaler()
+@functools.lru_cache(maxsize=None)
+def _windowed_sequence_class():
+    import tensorflow as tf
 
-X_train_scaled = x_scaler.fit_transform(X_train)
-X_test_scaled = x_scaler.transform(X_test)
-Y_train_scaled = y_scaler.fit_transform(Y_train)
-Y_test_scaled = y_scaler.transform(Y_test)
+    class WindowedSequence(tf.keras.utils.Sequence):
+        """Keras input pipeline over a WindowedDataset."""
+        def __init__(self, dataset, batch_size=32, shuffle=True):
+            super().__init__()
+            self.dataset = dataset
+            self.batch_size = batch_size
+            self.shuffle = shuffle
+            self.order = np.arange(len(dataset))
+            self.on_epoch_end()
 
-# Create sequence data
-def create_sequences(X, y, time_steps=10):
-    Xs, ys = [], []
-    for i in range(len(X) - time_steps):
-        Xs.append(X[i:(i + time_steps)])
-        ys.append(y[i + time_steps])
-    return np.array(Xs), np.array(ys)
+        def __len__(self):
+            return self.dataset.n_batches(self.batch_size)
 
-time_steps = 10
-X_train_seq, Y_train_seq = create_sequences(X_train_scaled, Y_train_scaled, time_steps)
-X_test_seq, Y_test_seq = create_sequences(X_test_scaled, Y_test_scaled, time_steps)
+        def __getitem__(self, index):
+            indices = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+            return self.dataset.batch(np.sort(indices))
+
+        def on_epoch_end(self):
+            if self.shuffle:
+                np.random.shuffle(self.order)
+
+    return WindowedSequence
+
+def keras_sequence(dataset, batch_size=32, shuffle=True):
+    """Wrap a WindowedDataset for Keras' fit() and predict()."""
+    return _windowed_sequence_class()(dataset, batch_size=batch_size, shuffle=shuffle)
 
 # Define custom loss function correctly
 def custom_loss(y_true, y_pred):
+    import tensorflow as tf
     mse = tf.reduce_mean(tf.square(y_true - y_pred))
     mae = tf.reduce_mean(tf.abs(y_true - y_pred))
     return 0.7 * mse + 0.3 * mae
 
-# Build model
-model = tf.keras.Sequential([
-    tf.keras.layers.LSTM(128, return_sequences=True, 
-                        input_shape=(time_steps, X_train.shape[1])),
-    tf.keras.layers.Dropout(0.2),
-    tf.keras.layers.LSTM(64),
-    tf.keras.layers.Dropout(0.2),
-    tf.keras.layers.Dense(32, activation='relu'),
-    tf.keras.layers.BatchNormalization(),
-    tf.keras.layers.Dense(Y_train.shape[1])
-])
-
-# Compile model
-model.compile(
-    optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
-    loss=custom_loss,
-    metrics=['mae', 'mse']
-)
-
-# Callbacks
-callbacks = [
-    EarlyStopping(
-        monitor='val_loss',
-        patience=10,
-        restore_best_weights=True
-    ),
-    ReduceLROnPlateau(
-        monitor='val_loss',
-        factor=0.5,
-        patience=5,
-        min_lr=0.00001
+def build_model(time_steps, n_inputs, n_outputs):
+    """Build and compile the LSTM surrogate."""
+    import tensorflow as tf
+    model = tf.keras.Sequential([
+        tf.keras.layers.LSTM(128, return_sequences=True,
+                            input_shape=(time_steps, n_inputs)),
+        tf.keras.layers.Dropout(0.2),
+        tf.keras.layers.LSTM(64),
+        tf.keras.layers.Dropout(0.2),
+        tf.keras.layers.Dense(32, activation='relu'),
+        tf.keras.layers.BatchNormalization(),
+        tf.keras.layers.Dense(n_outputs)
+    ])
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
+        loss=custom_loss,
+        metrics=['mae', 'mse']
     )
-]
+    return model
+
+def train(model, train_dataset, val_dataset, epochs=100, batch_size=32):
+    """Train the model with early stopping; return the Keras history."""
+    from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
+    callbacks = [
+        EarlyStopping(
+            monitor='val_loss',
+            patience=10,
+            restore_best_weights=True
+        ),
+        ReduceLROnPlateau(
+            monitor='val_loss',
+            factor=0.5,
+            patience=5,
+            min_lr=0.00001
+        )
+    ]
+    return model.fit(
+        keras_sequence(train_dataset, batch_size=batch_size),
+        epochs=epochs,
+        validation_data=keras_sequence(val_dataset, batch_size=batch_size, shuffle=False),
+        callbacks=callbacks,
+        verbose=1
+    )
+
+def stream_dataset(stream):
+    """Wrap a ScenarioStream as a prefetching tf.data.Dataset."""
+    import tensorflow as tf
+    n_inputs, n_outputs = len(stream.input_features), len(stream.output_features)
+    return tf.data.Dataset.from_generator(
+        lambda: iter(stream),
+        output_signature=(
+            tf.TensorSpec(shape=(None, stream.time_steps, n_inputs), dtype=tf.float32),
+            tf.TensorSpec(shape=(None, n_outputs), dtype=tf.float32),
+        )).prefetch(tf.data.AUTOTUNE)
+
+def train_streaming(model, stream, val_dataset, epochs=100, steps_per_epoch=1000):
+    """Train the model on batches of a ScenarioStream; return the Keras
+    history."""
+    from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
+    callbacks = [
+        EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True),
+        ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=5, min_lr=0.00001)
+    ]
+    return model.fit(
+        stream_dataset(stream),
+        epochs=epochs,
+        steps_per_epoch=steps_per_epoch,
+        validation_data=keras_sequence(val_dataset, batch_size=stream.batch_size, shuffle=False),
+        callbacks=callbacks,
+        verbose=1
+    )
+
+def evaluate(model, test_dataset, y_scaler, output_features=OUTPUT_FEATURES):
+    """Print and return the MAE and MSE of every output on the test set."""
+    Y_pred_scaled = model.predict(keras_sequence(test_dataset, batch_size=256, shuffle=False))
+    Y_pred = y_scaler.inverse_transform(Y_pred_scaled)
+    Y_test_actual = y_scaler.inverse_transform(
+        np.asarray(test_dataset.y[test_dataset.starts + test_dataset.time_steps]))
+    metrics = {}
+    for i, feature in enumerate(output_features):
+        mae = np.mean(np.abs(Y_pred[:, i] - Y_test_actual[:, i]))
+        mse = np.mean((Y_pred[:, i] - Y_test_actual[:, i])**2)
+        print(f'{feature} - MAE: {mae:.4f}, MSE: {mse:.4f}')
+        metrics[feature] = {'mae': float(mae), 'mse': float(mse)}
+    return metrics
+
+def plot_history(history, path='training_results.png'):
+    """Plot the training and validation loss over the epochs."""
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(12, 6))
+    plt.plot(history.history['loss'], label='Training Loss')
+    plt.plot(history.history['val_loss'], label='Validation Loss')
+    plt.title('Model Loss Over Time')
+    plt.xlabel('Epoch')
+    plt.ylabel('Loss')
+    plt.legend()
+    plt.savefig(path)
+    plt.close()
+
+def export(model, x_scaler, y_scaler, test_dataset, path='inventory_surrogate.npz'):
+    """Export for NumPy-only inference and check it against Keras."""
+    from surrogate_inference import NumpySurrogate, export_surrogate
+    export_surrogate(model, x_scaler, y_scaler, path)
+    surrogate = NumpySurrogate.load(path)
+    X_check, _ = test_dataset.batch(slice(0, 256))
+    difference = np.abs(y_scaler.inverse_transform(surrogate.predict_scaled(X_check))
+                        - y_scaler.inverse_transform(model.predict(X_check)))
+    print(f'NumPy surrogate - max abs difference to Keras: {difference.max():.2e}')
+
+def main(source=None, config=None, epochs=100, cache_dir='.preprocessing_cache'):
+    """Run the whole pipeline and save the model, its scalers and its
+    NumPy export."""
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    prepared = preprocess(source, config, cache_dir)
+    train_dataset, val_dataset, test_dataset = make_datasets(prepared, config)
+    model = build_model(config['time_steps'], len(config['input_features']),
+                        len(config['output_features']))
+    history = train(model, train_dataset, val_dataset, epochs=epochs)
+    evaluate(model, test_dataset, prepared['y_scaler'], config['output_features'])
+    plot_history(history)
+    # Save model
+    model.save('inventory_lstm_model.keras')
+    save_scalers('inventory_scalers.npz', prepared['x_scaler'], prepared['y_scaler'])
+    export(model, prepared['x_scaler'], prepared['y_scaler'], test_dataset)
+    return model
+
+def main_streaming(config=None, epochs=100, steps_per_epoch=1000, steps_per_scenario=1000,
+                   fit_scenarios=20, validation_scenarios=20, seed=None, workers=None):
+    """Train on an endless stream of freshly simulated scenarios.
+
+    The scalers are fitted on the first `fit_scenarios` scenarios of the
+    stream, except for the static parameters, which are scaled over their
+    whole range in SCENARIO_PARAMETERS so that later scenarios stay within
+    it. The next `validation_scenarios` are held out for validation and
+    testing.
+    """
+    from inventory_data_generator import parameter_ranges
+    from scenario_stream import ScenarioStream
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    with ScenarioStream(config['input_features'], config['output_features'],
+                        steps_per_scenario=steps_per_scenario,
+                        time_steps=config['time_steps'], seed=seed, workers=workers) as stream:
+        sample = stream.take(fit_scenarios)
+        x_names, y_names = config['input_features'], config['output_features']
+        x_scaler = set_scaler_ranges(fit_scaler(sample.x), x_names, parameter_ranges(x_names))
+        y_scaler = set_scaler_ranges(fit_scaler(sample.y), y_names, parameter_ranges(y_names))
+        stream.x_scaler, stream.y_scaler = x_scaler, y_scaler
+        val_dataset, test_dataset = stream.take(validation_scenarios).split(0.5)
+        model = build_model(config['time_steps'], len(config['input_features']),
+                            len(config['output_features']))
+        history = train_streaming(model, stream, val_dataset, epochs=epochs,
+                                  steps_per_epoch=steps_per_epoch)
+    evaluate(model, test_dataset, y_scaler, config['output_features'])
+    plot_history(history)
+    model.save('inventory_lstm_model.keras')
+    save_scalers('inventory_scalers.npz', x_scaler, y_scaler)
+    return model
+
 
-# Train model
-history = model.fit(
-    X_train_seq, Y_train_seq,
-    epochs=100,
-    batch_size=32,
-    validation_split=0.2,
-    callbacks=callbacks,
-    verbose=1
-)
-
-# Evaluate and predict
-Y_pred_scaled = model.predict(X_test_seq)
-Y_pred = y_scaler.inverse_transform(Y_pred_scaled)
-Y_test_actual = y_scaler.inverse_transform(Y_test_seq)
-
-# Calculate metrics
-for i, feature in enumerate(output_features):
-    mae = np.mean(np.abs(Y_pred[:, i] - Y_test_actual[:, i]))
-    mse = np.mean((Y_pred[:, i] - Y_test_actual[:, i])**2)
-    print(f'{feature} - MAE: {mae:.4f}, MSE: {mse:.4f}')
-
-# Plot results
-plt.figure(figsize=(12, 6))
-plt.plot(history.history['loss'], label='Training Loss')
-plt.plot(history.history['val_loss'], label='Validation Loss')
-plt.title('Model Loss Over Time')
-plt.xlabel('Epoch')
-plt.ylabel('Loss')
-plt.legend()
-plt.savefig('training_results.png')
-plt.close()
-
-# Save model
-model.save('inventory_lstm_model.keras')
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data', default=None,
+                        help='CSV file or columnar dataset directory')
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--cache-dir', default='.preprocessing_cache')
+    parser.add_argument('--stream', action='store_true',
+                        help='train on scenarios simulated on the fly instead of --data')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    if args.stream:
+        main_streaming(epochs=args.epochs, seed=args.seed)
+    else:
+        main(args.data, epochs=args.epochs, cache_dir=args.cache_dir)
@@ -0,0 +1,143 @@
+"""
+Search for the (reorder_point, reorder_quantity) policy of the raw material
+inventory with the lowest inventory cost that meets a target fill rate.
+"""
+import argparse
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from inventory_data_generator import apply_scenario
+from inventory_system import SimulationEnvironment
+
+def simulate_policy(reorder_point, reorder_quantity, seed_sequence, horizon=24 * 90,
+                    warmup=24 * 7, scenario=None, raw_material_holding_cost=1,
+                    order_cost=50):
+    """Simulate one replication of a reorder policy.
+
+    Replications that share `seed_sequence` see the same demand, failures and
+    repairs whatever the policy (common random numbers). Returns the fill
+    rate of the raw material (the fraction of the consumption requested by
+    machine 1 that was on hand), the fill rate of the produced goods, and the
+    inventory cost per step: holding costs of every stock plus `order_cost`
+    per order placed. The first `warmup` steps are not counted.
+    """
+    env = SimulationEnvironment(seed=seed_sequence)
+    if scenario:
+        apply_scenario(env, scenario)
+    env.raw_material.set_order_point_and_quantity(reorder_point, reorder_quantity)
+    env.run(warmup)
+    raw_material_level = env.raw_material.inventory_on_hand
+    orders_placed = env.raw_material.orders_placed
+    demand = env.accumulated_demand
+    fulfilled_demand = env.accumulated_fulfilled_demand
+
+    trajectory = env.run(horizon)
+    # Raw material is consumed from the stock on hand at the start of a step
+    on_hand = np.concatenate(([raw_material_level], trajectory["raw_material_level"][:-1]))
+    requested = env.machine1.production_rate * horizon
+    consumed = np.minimum(on_hand, env.machine1.production_rate).sum()
+    holding_cost = (raw_material_holding_cost * trajectory["raw_material_level"].mean()
+                    + env.buffer.holding_cost * trajectory["buffer_level"].mean()
+                    + env.produced_goods.holding_cost * trajectory["produced_goods_level"].mean())
+    orders = env.raw_material.orders_placed - orders_placed
+    demand = env.accumulated_demand - demand
+    return {
+        "raw_material_fill_rate": consumed / requested if requested else 1.0,
+        "fill_rate": (env.accumulated_fulfilled_demand - fulfilled_demand) / demand if demand else 1.0,
+        "inventory_cost": holding_cost + order_cost * orders / horizon,
+    }
+
+def check_common_random_numbers(seed_sequence, steps=500):
+    """Raise RuntimeError unless two environments built from the same seed
+    sequence give identical trajectories, which the comparison of policies
+    on common random numbers relies on."""
+    first = SimulationEnvironment(seed=seed_sequence).run(steps)
+    second = SimulationEnvironment(seed=seed_sequence).run(steps)
+    if not np.array_equal(first, second):
+        raise RuntimeError("Environments with the same seed sequence diverge")
+
+def _simulate_policy(args):
+    policy, seed_sequence, options = args
+    return simulate_policy(*policy, seed_sequence, **options)
+
+def optimize_policy(reorder_points=range(0, 41, 5), reorder_quantities=range(10, 81, 10),
+                    min_fill_rate=0.95, fill_rate="raw_material_fill_rate",
+                    replications=(2, 4, 8, 16), eta=3, shortage_penalty=1000,
+                    seed=None, workers=1, **options):
+    """Find the policy with the lowest inventory cost among all combinations
+    of `reorder_points` and `reorder_quantities` by successive halving.
+
+    Every candidate is first simulated for replications[0] replications; then
+    only the best 1/`eta` of them get simulated up to the next number of
+    replications, and so on. Candidates are ranked by their mean inventory
+    cost plus `shortage_penalty` per unit of `fill_rate` below
+    `min_fill_rate`. Replication i uses the same random numbers for every
+    candidate, so the differences between them are not hidden by noise.
+
+    `fill_rate` defaults to the raw material fill rate: machine 1 keeps
+    producing when the raw material runs out, so the fill rate of the
+    produced goods does not depend on the policy in this model. The other
+    keyword arguments are passed to simulate_policy(). Returns the best
+    policy with its mean results, and the results of every round.
+    """
+    seed_sequences = np.random.SeedSequence(seed).spawn(replications[-1])
+    check_common_random_numbers(seed_sequences[0])
+    candidates = list(itertools.product(reorder_points, reorder_quantities))
+    results = {candidate: [] for candidate in candidates}
+    rounds = []
+    executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count()) if workers != 1 else None
+    try:
+        for round_replications in replications:
+            tasks = [(candidate, seed_sequences[i], options)
+                     for candidate in candidates
+                     for i in range(len(results[candidate]), round_replications)]
+            if executor is None:
+                outcomes = map(_simulate_policy, tasks)
+            else:
+                outcomes = executor.map(_simulate_policy, tasks, chunksize=max(1, len(tasks) // 64))
+            for (candidate, _, _), outcome in zip(tasks, outcomes):
+                results[candidate].append(outcome)
+
+            summaries = []
+            for candidate in candidates:
+                summary = {
+                    key: float(np.mean([outcome[key] for outcome in results[candidate]]))
+                    for key in results[candidate][0]}
+                summary["score"] = summary["inventory_cost"] + shortage_penalty * max(
+                    0.0, min_fill_rate - summary[fill_rate])
+                summary["reorder_point"], summary["reorder_quantity"] = candidate
+                summary["replications"] = len(results[candidate])
+                summaries.append(summary)
+            summaries.sort(key=lambda summary: summary["score"])
+            rounds.append(summaries)
+            if len(summaries) == 1:
+                break
+            survivors = summaries[:max(1, math.ceil(len(summaries) / eta))]
+            candidates = [(summary["reorder_point"], summary["reorder_quantity"])
+                          for summary in survivors]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return {"best": rounds[-1][0], "rounds": rounds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--min-fill-rate', type=float, default=0.95)
+    parser.add_argument('--horizon', type=int, default=24 * 90)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker processes, 0 for one per core')
+    args = parser.parse_args()
+    search = optimize_policy(min_fill_rate=args.min_fill_rate, seed=args.seed,
+                             workers=args.workers or None, horizon=args.horizon)
+    for round_number, summaries in enumerate(search["rounds"]):
+        print(f"Round {round_number + 1}: {len(summaries)} candidates, "
+              f"{summaries[0]['replications']} replications")
+    best = search["best"]
+    print(f"Best policy: reorder point {best['reorder_point']}, "
+          f"reorder quantity {best['reorder_quantity']} - "
+          f"fill rate {best['raw_material_fill_rate']:.3f}, "
+          f"inventory cost {best['inventory_cost']:.2f}/step")
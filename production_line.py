@@ -0,0 +1,269 @@
+"""
+Production lines of any number of machines and buffers, defined by a config.
+
+A line is a graph: every machine takes material from one buffer (or from the
+raw material supply) and puts its output into one buffer (or into the
+produced goods). Machines can work in parallel on the same buffers. For
+example, the line of SimulationEnvironment is:
+
+    {
+        "machines": [
+            {"name": "m1", "max_production_rate": 10, "mttf": 80, "mttr": 20,
+             "defect_rate": 0.05, "output": "buffer"},
+            {"name": "m2", "max_production_rate": 8, "mttf": 75, "mttr": 10,
+             "defect_rate": 0.03, "input": "buffer"},
+        ],
+        "buffers": [{"name": "buffer", "max_capacity": 50}],
+        "produced_goods": {"max_capacity": 100},
+        "demand": {"mean": 7, "std": 2},
+    }
+
+The machines and buffers follow the rules of the scalar components, and
+like machine 1 in SimulationEnvironment, machines without an input are never
+short of raw material.
+"""
+import json
+import numpy as np
+from inventory_system import RandomStream
+
+PRODUCED_GOODS = "produced_goods"
+
+class ProductionLine:
+    """Simulation of a production line with its state in flat arrays.
+
+    Every field of the machines is an array indexed by machine, and the
+    levels and capacities of the buffers are arrays indexed by buffer, with
+    the produced goods as the last buffer. A step operates all the machines
+    at once, then moves material level by level in topological order, each
+    level with a few array operations whatever the number of machines in it.
+    Lines made of serial chains (one machine taking from and feeding each
+    buffer) are moved in a fixed number of array operations instead.
+    """
+    def __init__(self, config, seed=None, rng=None):
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        demand_rng, self.machine_rng = self.rng.spawn(2)
+        self.demand_stream = RandomStream(demand_rng, "standard_normal")
+        self.config = config
+
+        machines = config["machines"]
+        self.machine_names = [machine["name"] for machine in machines]
+        self.buffer_names = [buffer["name"] for buffer in config.get("buffers", [])]
+        self.buffer_names.append(PRODUCED_GOODS)
+        if len(set(self.machine_names)) != len(machines) or \
+                len(set(self.buffer_names)) != len(self.buffer_names):
+            raise ValueError("Machine and buffer names must be unique")
+        buffer_index = {name: i for i, name in enumerate(self.buffer_names)}
+
+        def field(name):
+            return np.array([machine[name] for machine in machines], dtype=float)
+
+        self.max_production_rate = field("max_production_rate")
+        self.production_rate = self.max_production_rate.copy()
+        self.mttf = field("mttf")
+        self.mttr = field("mttr")
+        self.defect_rate = field("defect_rate")
+        self.operational = np.ones(len(machines), dtype=bool)
+        self.downtime = np.zeros(len(machines))
+        try:
+            self.input = np.array([buffer_index[machine["input"]] if machine.get("input") else -1
+                                   for machine in machines], dtype=np.intp)
+            self.output = np.array([buffer_index[machine.get("output", PRODUCED_GOODS)]
+                                    for machine in machines], dtype=np.intp)
+        except KeyError as error:
+            raise ValueError(f"Unknown buffer {error}") from None
+
+        self.max_capacity = np.array(
+            [buffer["max_capacity"] for buffer in config.get("buffers", [])]
+            + [config.get("produced_goods", {}).get("max_capacity", 100)], dtype=float)
+        self.level = np.zeros(len(self.buffer_names))
+        self.demand_mean = config.get("demand", {}).get("mean", 7)
+        self.demand_std = config.get("demand", {}).get("std", 2)
+        self.accumulated_demand = 0
+        self.accumulated_fulfilled_demand = 0
+
+        self.levels = self._topological_levels()
+        self.chains = self._serial_chains()
+        self.draws = np.empty((0, len(machines)))
+        self.draw_index = 0
+
+    @classmethod
+    def from_file(cls, path, seed=None, rng=None):
+        """Create a line from a JSON config file."""
+        with open(path) as f:
+            return cls(json.load(f), seed=seed, rng=rng)
+
+    @property
+    def n_machines(self):
+        return len(self.machine_names)
+
+    def _topological_levels(self):
+        """Group the machines by the length of the longest path of machines
+        feeding them, and precompute the indices used to move material.
+
+        Within a level the machines are sorted by input buffer, and machines
+        sharing a buffer are served in the order of the config.
+        """
+        level_of = np.full(self.n_machines, -1)
+        for _ in range(self.n_machines):
+            for machine in range(self.n_machines):
+                if self.input[machine] < 0:
+                    level_of[machine] = 0
+                    continue
+                feeders = np.flatnonzero(self.output == self.input[machine])
+                if len(feeders) == 0:
+                    level_of[machine] = 0
+                elif np.all(level_of[feeders] >= 0):
+                    level_of[machine] = level_of[feeders].max() + 1
+            if np.all(level_of >= 0):
+                break
+        if np.any(level_of < 0):
+            raise ValueError("The line has a cycle of machines and buffers")
+
+        levels = []
+        for level in range(level_of.max(initial=-1) + 1):
+            machines = np.flatnonzero(level_of == level)
+            machines = machines[np.argsort(self.input[machines], kind="stable")]
+            inputs = self.input[machines]
+            fed = inputs >= 0
+            # Position in the level of the first machine on the same input
+            first = np.searchsorted(inputs, inputs)
+            levels.append({"machines": machines, "inputs": inputs, "fed": fed,
+                           "first": first, "outputs": self.output[machines]})
+        return levels
+
+    def _serial_chains(self):
+        """If the line is made of serial chains of machines, return the
+        machines in chain order with the indices used by _step_chains();
+        otherwise None."""
+        producers = np.bincount(self.output, minlength=len(self.buffer_names))[:-1]
+        consumers = np.bincount(self.input[self.input >= 0], minlength=len(self.buffer_names))[:-1]
+        if np.any(producers != 1) or np.any(consumers != 1):
+            return None
+        consumer = {buffer: machine for machine, buffer in enumerate(self.input) if buffer >= 0}
+        order = []
+        for head in np.flatnonzero(self.input < 0):
+            machine = head
+            while True:
+                order.append(machine)
+                if self.output[machine] == len(self.buffer_names) - 1:
+                    break
+                machine = consumer[self.output[machine]]
+        order = np.array(order, dtype=np.intp)
+        inputs = self.input[order]
+        fed = inputs >= 0
+        heads = np.flatnonzero(~fed)
+        return {"machines": order, "fed": fed, "inputs": inputs[fed],
+                "head": np.repeat(heads, np.diff(np.append(heads, len(order)))),
+                "chain": np.cumsum(~fed) - 1, "outputs": self.output[order]}
+
+    def _operate(self):
+        """Vectorized Machine.operate() of every machine; return the output of
+        each machine if it were not short of material."""
+        if self.draw_index == len(self.draws):
+            self.draws = self.machine_rng.random((4096, self.n_machines))
+            self.draw_index = 0
+        draw = self.draws[self.draw_index]
+        self.draw_index += 1
+        failed = self.operational & (draw < 1 / self.mttf)
+        repaired = ~self.operational & (draw < 1 / self.mttr)
+        producing = self.operational & ~failed
+        self.downtime[~self.operational] += 1
+        self.downtime[failed] = 1
+        self.operational = producing | repaired
+        return np.where(producing, self.production_rate * (1 - self.defect_rate), 0.0)
+
+    def _step_levels(self, capacity):
+        """Move the material through the line level by level; return the
+        production of every machine."""
+        production = np.empty(self.n_machines)
+        n_buffers = len(self.buffer_names)
+        for level in self.levels:
+            machines, inputs, fed = level["machines"], level["inputs"], level["fed"]
+            output = capacity[machines]
+            if fed.any():
+                # Machines sharing a buffer take their rate from it in turn
+                requested = np.where(fed, self.production_rate[machines], 0.0)
+                before = np.cumsum(requested) - requested
+                before -= before[level["first"]]
+                available = np.clip(self.level[inputs] - before, 0, requested)
+                self.level -= np.bincount(inputs[fed], available[fed], minlength=n_buffers)
+                output = np.where(fed, np.minimum(output, available), output)
+            output = np.trunc(output)
+            production[machines] = output
+            self.level = np.minimum(
+                self.level + np.bincount(level["outputs"], output, minlength=n_buffers),
+                self.max_capacity)
+        return production
+
+    def _step_chains(self, capacity):
+        """Move the material through serial chains of machines at once; return
+        the production of every machine.
+
+        Along a chain the output of a machine is
+        out[k] = min(out[k - 1] + floor(level[k]), limit[k]), with level[k] the
+        level of its input buffer and limit[k] the floor of its capacity, rate
+        and input buffer capacity. Unrolled, that is a cumulative sum plus a
+        cumulative minimum, the same result as _step_levels() without a loop
+        over the stations.
+        """
+        chains = self.chains
+        machines, fed, inputs = chains["machines"], chains["fed"], chains["inputs"]
+        rate = self.production_rate[machines]
+        floor_level = np.zeros(len(machines))
+        floor_level[fed] = np.floor(self.level[inputs])
+        total_level = np.cumsum(floor_level)
+        total_level -= total_level[chains["head"]]
+        limit = np.floor(np.minimum(capacity[machines], rate))
+        limit[fed] = np.minimum(limit[fed], np.floor(self.max_capacity[inputs]))
+        bound = limit - total_level
+        # Offset each chain below the previous ones so the minimum restarts
+        offset = chains["chain"] * (2 * np.abs(bound).max() + 1)
+        output = total_level + np.minimum.accumulate(bound - offset) + offset
+
+        production = np.empty(self.n_machines)
+        production[machines] = output
+        level = np.minimum(
+            self.level + np.bincount(chains["outputs"], output, minlength=len(self.level)),
+            self.max_capacity)
+        level[inputs] -= np.minimum(rate[fed], level[inputs])
+        self.level = level
+        return production
+
+    def step(self):
+        """Advance the line by one time step."""
+        demand = max(0, int(self.demand_mean + self.demand_std * self.demand_stream.next()))
+        capacity = self._operate()
+        if self.chains is not None:
+            production = self._step_chains(capacity)
+        else:
+            production = self._step_levels(capacity)
+
+        # Fulfill demand
+        fulfilled_demand = min(demand, self.level[-1])
+        self.level[-1] -= fulfilled_demand
+        self.accumulated_demand += demand
+        self.accumulated_fulfilled_demand += fulfilled_demand
+        return {
+            "production": production,
+            "buffer_level": self.level[:-1].copy(),
+            "produced_goods_level": self.level[-1],
+            "demand": self.accumulated_demand,
+            "fulfilled_demand": self.accumulated_fulfilled_demand,
+            "status": self.operational.astype(np.int8),
+        }
+
+    def run(self, n_steps):
+        """Advance the line by `n_steps` time steps and return the results of
+        step() stacked into arrays with one row per step."""
+        trajectory = {
+            "production": np.empty((n_steps, self.n_machines)),
+            "buffer_level": np.empty((n_steps, len(self.buffer_names) - 1)),
+            "produced_goods_level": np.empty(n_steps),
+            "demand": np.empty(n_steps),
+            "fulfilled_demand": np.empty(n_steps),
+            "status": np.empty((n_steps, self.n_machines), dtype=np.int8),
+        }
+        for i in range(n_steps):
+            for key, value in self.step().items():
+                trajectory[key][i] = value
+        return trajectory
@@ -0,0 +1,156 @@
+"""
+Scenario designs for the training data of the surrogate.
+
+base_design() spreads scenarios evenly over the ranges of
+SCENARIO_PARAMETERS with a Latin hypercube or a Sobol sequence, instead of
+sampling every parameter independently. adaptive_design() then adds
+scenarios in rounds where the surrogate does worst: each round, candidate
+scenarios are scored by the error (or ensemble disagreement) observed at the
+nearest scenarios already simulated, plus a bonus for being far from all of
+them, and the best candidates are simulated next. The designs are lists of
+scenario dicts, as taken by generate_data(scenarios=...).
+"""
+import numpy as np
+from inventory_data_generator import SCENARIO_PARAMETERS, simulate_scenario
+
+def latin_hypercube(n, dimensions, rng):
+    """Return `n` points of a Latin hypercube in the unit cube: in every
+    dimension, each of `n` equal slices holds exactly one point."""
+    slices = np.argsort(rng.random((dimensions, n)), axis=1).T
+    return (slices + rng.random((n, dimensions))) / n
+
+def sobol(n, dimensions, seed=None):
+    """Return the first `n` points of a scrambled Sobol sequence (scipy)."""
+    from scipy.stats import qmc
+    sampler = qmc.Sobol(dimensions, scramble=True, seed=seed)
+    if n & (n - 1) == 0:
+        return sampler.random_base2(int(np.log2(n)))
+    return sampler.random(n)
+
+def unit_to_scenarios(points):
+    """Map points of the unit cube to scenario dicts over the ranges of
+    SCENARIO_PARAMETERS."""
+    scenarios = []
+    for point in points:
+        scenario = {}
+        for u, (path, low, high, integer) in zip(point, SCENARIO_PARAMETERS):
+            if integer:
+                scenario[path] = int(min(low + np.floor(u * (high - low + 1)), high))
+            else:
+                scenario[path] = float(low + u * (high - low))
+        scenarios.append(scenario)
+    return scenarios
+
+def scenarios_to_unit(scenarios):
+    """Inverse of unit_to_scenarios(), to the centers of the integer slices."""
+    points = np.empty((len(scenarios), len(SCENARIO_PARAMETERS)))
+    for i, scenario in enumerate(scenarios):
+        for j, (path, low, high, integer) in enumerate(SCENARIO_PARAMETERS):
+            if integer:
+                points[i, j] = (scenario[path] - low + 0.5) / (high - low + 1)
+            else:
+                points[i, j] = (scenario[path] - low) / (high - low)
+    return points
+
+def base_design(n_scenarios, method='lhs', seed=None):
+    """Return `n_scenarios` space-filling scenarios; `method` is 'lhs'
+    (Latin hypercube), 'sobol' or 'random'."""
+    dimensions = len(SCENARIO_PARAMETERS)
+    rng = np.random.default_rng(seed)
+    if method == 'lhs':
+        points = latin_hypercube(n_scenarios, dimensions, rng)
+    elif method == 'sobol':
+        points = sobol(n_scenarios, dimensions, seed=rng)
+    elif method == 'random':
+        points = rng.random((n_scenarios, dimensions))
+    else:
+        raise ValueError(f"Unknown design method: {method}")
+    return unit_to_scenarios(points)
+
+def scenario_scores(surrogates, scenarios, steps=500, time_steps=10, seed=None):
+    """Simulate each scenario for `steps` steps and score how badly the
+    surrogates predict it.
+
+    `surrogates` are NumpySurrogate instances trained on the same features.
+    With one surrogate the score is its mean absolute error; with several it
+    is their disagreement, the mean standard deviation of their predictions.
+    Both are measured on the scaled outputs, so every output counts the same.
+    """
+    from inventory_data_generator import scenario_features
+    from neural_network import INPUT_FEATURES, OUTPUT_FEATURES
+    from windowed_dataset import WindowedDataset
+    seeds = np.random.SeedSequence(seed).spawn(len(scenarios))
+    scores = np.empty(len(scenarios))
+    for i, (scenario, scenario_seed) in enumerate(zip(scenarios, seeds)):
+        parameters, trajectory = simulate_scenario(scenario_seed, steps, scenario)
+        x = scenario_features(parameters, trajectory, INPUT_FEATURES)
+        y = scenario_features(parameters, trajectory, OUTPUT_FEATURES)
+        windows, targets = WindowedDataset(x, y, np.zeros(len(x)), time_steps).arrays()
+        predictions = np.stack([surrogate.predict(windows) * surrogate.y_scale + surrogate.y_min
+                                for surrogate in surrogates])
+        if len(surrogates) == 1:
+            reference = surrogates[0]
+            scores[i] = np.mean(np.abs(predictions[0] - (targets * reference.y_scale
+                                                         + reference.y_min)))
+        else:
+            scores[i] = predictions.std(axis=0).mean()
+    return scores
+
+def propose_scenarios(design, scores, n_scenarios, n_candidates=2000, exploration=1.0,
+                      neighbours=5, seed=None):
+    """Pick `n_scenarios` new scenarios where the surrogate is expected to do
+    worst, given the `scores` of the scenarios of `design`.
+
+    The expected score of a candidate is the inverse-distance weighted mean
+    score of its nearest `neighbours` in the design. `exploration` weighs a
+    bonus for the distance to the closest scenario, relative to the typical
+    spacing of the design. The candidates are picked one at a time, counting
+    those already picked as part of the design, so they do not cluster.
+    """
+    rng = np.random.default_rng(seed)
+    points = scenarios_to_unit(design)
+    scores = np.asarray(scores, dtype=float)
+    candidates = latin_hypercube(n_candidates, points.shape[1], rng)
+
+    distances = np.linalg.norm(candidates[:, None] - points[None], axis=2)
+    nearest = np.argsort(distances, axis=1)[:, :neighbours]
+    weights = 1 / (np.take_along_axis(distances, nearest, axis=1) + 1e-9)
+    expected = (weights * scores[nearest]).sum(axis=1) / weights.sum(axis=1)
+    expected /= max(scores.mean(), 1e-12)
+
+    spacing = np.linalg.norm(points[:, None] - points[None], axis=2)
+    np.fill_diagonal(spacing, np.inf)
+    spacing = np.median(spacing.min(axis=1)) if len(points) > 1 else 1.0
+    closest = distances.min(axis=1)
+    picked = []
+    for _ in range(min(n_scenarios, n_candidates)):
+        acquisition = expected + exploration * closest / spacing
+        acquisition[picked] = -np.inf
+        best = int(np.argmax(acquisition))
+        picked.append(best)
+        # Candidates close to a picked one lose their distance bonus
+        closest = np.minimum(closest, np.linalg.norm(candidates - candidates[best], axis=1))
+    return unit_to_scenarios(candidates[picked])
+
+def adaptive_design(evaluate, n_initial=64, n_rounds=4, batch_size=16, method='lhs',
+                    seed=None, **options):
+    """Build a design in rounds.
+
+    `evaluate(design)` gets the whole design so far, e.g. generates the data
+    of its scenarios and retrains the surrogate, and returns one score per
+    scenario, higher where the surrogate does worse (see scenario_scores()).
+    The design starts with `n_initial` scenarios of base_design(), and
+    `batch_size` scenarios from propose_scenarios() are added per round; the
+    other keyword arguments are passed to it. Returns the design and the
+    scores of each round.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(n_rounds + 1)
+    design = base_design(n_initial, method, seed=seeds[0])
+    history = []
+    for round_seed in seeds[1:]:
+        scores = np.asarray(evaluate(design))
+        history.append(scores)
+        design = design + propose_scenarios(design, scores, batch_size, seed=round_seed,
+                                            **options)
+    history.append(np.asarray(evaluate(design)))
+    return design, history
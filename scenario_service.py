@@ -0,0 +1,269 @@
+"""
+Local simulation service shared by the GUI, notebooks and scripts.
+
+The server reads one JSON request per line, e.g.
+
+    {"parameters": {"machine1.mttf": 90, "demand_mean": 8}, "horizon": 2000, "seed": 1}
+
+and answers with one JSON line per chunk of the trajectory as soon as it is
+simulated, {"chunk": 0, "start": 0, "records": {"raw_material_level": [...],
+...}}, followed by {"done": true, ...}. The parameters are those of the GUI
+(PARAMETERS), as attribute paths like in inventory_data_generator.py.
+
+Scenarios run on a process pool. Completed trajectories are kept in an LRU
+cache keyed by a hash of the canonical request, and clients asking for a
+scenario that is still running follow the same run, so a scenario is only
+simulated once. Requests without a seed are neither cached nor shared.
+"""
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from inventory_data_generator import apply_scenario
+from inventory_system import TRAJECTORY_DTYPE, SimulationEnvironment
+
+DEFAULT_PORT = 8765
+
+# Parameters of SimulationUI.create_widgets: (attribute path, type, default)
+PARAMETERS = [
+    ('raw_material.lead_time', float, 8),
+    ('raw_material.max_capacity', float, 100),
+    ('machine1.max_production_rate', float, 10),
+    ('machine1.mttf', float, 80),
+    ('machine1.mttr', float, 20),
+    ('machine1.defect_rate', float, 0.05),
+    ('machine2.max_production_rate', float, 8),
+    ('machine2.mttf', float, 75),
+    ('machine2.mttr', float, 10),
+    ('machine2.defect_rate', float, 0.03),
+    ('buffer.max_capacity', int, 50),
+    ('produced_goods.max_capacity', float, 100),
+    ('demand_mean', float, 7),
+    ('demand_std', float, 2),
+]
+
+def canonical_request(request):
+    """Return the request with every parameter set and converted to its type;
+    raise ValueError for unknown parameters or invalid values."""
+    parameters = dict(request.get('parameters', {}))
+    known = {path for path, _, _ in PARAMETERS}
+    unknown = set(parameters) - known
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    horizon = int(request.get('horizon', 48))
+    if horizon <= 0:
+        raise ValueError("The horizon must be positive")
+    seed = request.get('seed')
+    return {
+        'parameters': {path: kind(parameters.get(path, default))
+                       for path, kind, default in PARAMETERS},
+        'horizon': horizon,
+        'seed': None if seed is None else int(seed),
+    }
+
+def request_key(request):
+    """Hash of a canonical request."""
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+def simulate_chunk(env, request, steps):
+    """Simulate the next `steps` steps of a request on `env` (a new
+    environment if None); return the environment and the trajectory."""
+    if env is None:
+        env = SimulationEnvironment(seed=request['seed'])
+        apply_scenario(env, request['parameters'])
+    return env, env.run(steps)
+
+class _Run:
+    """Encoded chunks of one simulation, as they become available."""
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+
+    async def publish(self, chunk=None, done=False, error=None):
+        async with self.changed:
+            if chunk is not None:
+                self.chunks.append(chunk)
+            self.done = done
+            self.error = error
+            self.changed.notify_all()
+
+    async def follow(self):
+        """Yield every chunk, waiting for those not simulated yet."""
+        index = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: len(self.chunks) > index or self.done)
+                chunks, done, error = self.chunks[index:], self.done, self.error
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if done:
+                if error is not None:
+                    raise RuntimeError(error)
+                return
+
+class ScenarioService:
+    """Asyncio server running scenarios on `workers` processes (one per core
+    if None), in chunks of `chunk_steps` steps, and keeping the last
+    `cache_size` completed ones."""
+    def __init__(self, workers=None, cache_size=128, chunk_steps=24 * 7):
+        # Forked workers would inherit the sockets of the open connections
+        self.executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                            mp_context=multiprocessing.get_context('spawn'))
+        self.cache_size = cache_size
+        self.chunk_steps = chunk_steps
+        self.cache = collections.OrderedDict()
+        self.running = {}
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        """Stop the worker processes."""
+        self.executor.shutdown(cancel_futures=True)
+
+    async def _simulate(self, run, request):
+        loop = asyncio.get_running_loop()
+        env = None
+        start = 0
+        try:
+            while start < request['horizon']:
+                steps = min(self.chunk_steps, request['horizon'] - start)
+                env, trajectory = await loop.run_in_executor(
+                    self.executor, simulate_chunk, env, request, steps)
+                # Encoded once, whatever the number of clients following
+                chunk = json.dumps({
+                    'key': run.key, 'chunk': len(run.chunks), 'start': start,
+                    'records': {name: trajectory[name].tolist() for name in TRAJECTORY_DTYPE.names},
+                }).encode() + b'\n'
+                await run.publish(chunk)
+                start += steps
+            if request['seed'] is not None:
+                self.cache[run.key] = run
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            await run.publish(done=True)
+        except Exception as error:
+            await run.publish(done=True, error=f"{type(error).__name__}: {error}")
+            raise
+        finally:
+            self.running.pop(run.key, None)
+
+    def results(self, request):
+        """Return whether the request was cached, and an async iterator over
+        its encoded chunks."""
+        request = canonical_request(request)
+        key = request_key(request)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return True, self.cache[key].follow()
+        self.misses += 1
+        run = self.running.get(key)
+        if run is None:
+            run = _Run(key)
+            if request['seed'] is not None:
+                self.running[key] = run
+            task = asyncio.create_task(self._simulate(run, request))
+            # Errors are reported to the clients through the run
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return False, run.follow()
+
+    async def handle(self, reader, writer):
+        """Answer the requests of one connection, one per line."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    cached, chunks = self.results(json.loads(line))
+                except (ValueError, TypeError, AttributeError) as error:
+                    writer.write(json.dumps({'error': str(error)}).encode() + b'\n')
+                    await writer.drain()
+                    continue
+                n_chunks = 0
+                try:
+                    async for chunk in chunks:
+                        writer.write(chunk)
+                        await writer.drain()
+                        n_chunks += 1
+                    response = {'done': True, 'cached': cached, 'chunks': n_chunks}
+                except RuntimeError as error:
+                    response = {'error': str(error)}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, path=None):
+        """Serve on `host`:`port`, or on the Unix socket `path`, until
+        cancelled."""
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+async def fetch_scenario(parameters=None, horizon=48, seed=0, host='127.0.0.1',
+                         port=DEFAULT_PORT, path=None):
+    """Ask a running service for a scenario and yield its trajectory chunk by
+    chunk, as structured arrays of TRAJECTORY_DTYPE."""
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path, limit=1 << 26)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 26)
+    try:
+        request = {'parameters': parameters or {}, 'horizon': horizon, 'seed': seed}
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        while True:
+            response = json.loads(await reader.readline())
+            if 'error' in response:
+                raise RuntimeError(response['error'])
+            if response.get('done'):
+                return
+            records = response['records']
+            chunk = np.empty(len(records[TRAJECTORY_DTYPE.names[0]]), dtype=TRAJECTORY_DTYPE)
+            for name in TRAJECTORY_DTYPE.names:
+                chunk[name] = records[name]
+            yield chunk
+    finally:
+        writer.close()
+
+def query_scenario(parameters=None, horizon=48, seed=0, **address):
+    """Blocking version of fetch_scenario() returning the whole trajectory."""
+    async def collect():
+        return [chunk async for chunk in fetch_scenario(parameters, horizon, seed, **address)]
+    chunks = asyncio.run(collect())
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=TRAJECTORY_DTYPE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', default=None, help='serve on this Unix socket instead')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker processes, 0 for one per core')
+    parser.add_argument('--cache-size', type=int, default=128)
+    parser.add_argument('--chunk-steps', type=int, default=24 * 7)
+    args = parser.parse_args()
+    service = ScenarioService(args.workers or None, args.cache_size, args.chunk_steps)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
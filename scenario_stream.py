@@ -0,0 +1,86 @@
+"""Stream of training batches simulated on the fly, without an intermediate
+data file."""
+import collections
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from inventory_data_generator import scenario_features, simulate_scenario
+from windowed_dataset import WindowedDataset
+
+class ScenarioStream:
+    """Endless stream of (x, y) training batches from freshly simulated
+    scenarios.
+
+    `workers` processes simulate scenarios of `steps_per_scenario` steps,
+    keeping up to `prefetch` of them in flight. The windows of `mix`
+    scenarios at a time are scaled, shuffled together and batched, so memory
+    use does not grow with the number of batches produced. Scenario i always
+    gets the same random stream for a given `seed`.
+    """
+    def __init__(self, input_features, output_features, x_scaler=None, y_scaler=None,
+                 steps_per_scenario=1000, time_steps=10, batch_size=32, mix=8,
+                 prefetch=16, seed=None, workers=None):
+        self.input_features = input_features
+        self.output_features = output_features
+        self.x_scaler = x_scaler
+        self.y_scaler = y_scaler
+        self.steps_per_scenario = steps_per_scenario
+        self.time_steps = time_steps
+        self.batch_size = batch_size
+        self.mix = mix
+        self.prefetch = prefetch
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.workers = workers or os.cpu_count()
+        self.executor = None
+        self.pending = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes."""
+        if self.executor is not None:
+            for future in self.pending:
+                future.cancel()
+            self.pending.clear()
+            self.executor.shutdown()
+            self.executor = None
+
+    def scenarios(self):
+        """Yield the unscaled (x, y) rows of one simulated scenario at a time."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        while True:
+            while len(self.pending) < self.prefetch:
+                scenario_seed, = self.seed_sequence.spawn(1)
+                self.pending.append(self.executor.submit(
+                    simulate_scenario, scenario_seed, self.steps_per_scenario))
+            parameters, trajectory = self.pending.popleft().result()
+            yield (scenario_features(parameters, trajectory, self.input_features),
+                   scenario_features(parameters, trajectory, self.output_features))
+
+    def take(self, n_scenarios):
+        """Simulate `n_scenarios` scenarios into a WindowedDataset, e.g. for
+        validation or to fit the scalers on its `x` and `y`."""
+        xs, ys = [], []
+        scenarios = self.scenarios()
+        for _ in range(n_scenarios):
+            x, y = next(scenarios)
+            xs.append(x)
+            ys.append(y)
+        scenario_id = np.repeat(np.arange(n_scenarios), [len(x) for x in xs])
+        return WindowedDataset(np.concatenate(xs), np.concatenate(ys), scenario_id,
+                               self.time_steps, self.x_scaler, self.y_scaler)
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed_sequence.spawn(1)[0])
+        scenarios = self.scenarios()
+        while True:
+            xs, ys = zip(*(next(scenarios) for _ in range(self.mix)))
+            scenario_id = np.repeat(np.arange(self.mix), [len(x) for x in xs])
+            dataset = WindowedDataset(np.concatenate(xs), np.concatenate(ys), scenario_id,
+                                      self.time_steps, self.x_scaler, self.y_scaler)
+            yield from dataset.batches(self.batch_size, seed=rng)
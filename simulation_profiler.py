@@ -0,0 +1,178 @@
+"""
+Opt-in profiling of SimulationEnvironment: time spent in each part of a step,
+counts of the failures, repairs, reorders and stockouts, and export as a
+summary table or a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+
+    profiler = SimulationProfiler(env)
+    with profiler:
+        env.run(10000)
+    print(profiler.summary())
+    profiler.export_chrome_trace("trace.json")
+
+While enabled the environment steps through SimulationEnvironment._advance()
+with a callback marking the end of each phase, set on the instance;
+disabling removes it, so an environment that is not being profiled runs the
+step without any callback.
+"""
+import argparse
+import json
+import os
+import time
+
+PHASES = ["demand", "raw_material", "machine1", "transfer", "machine2", "fulfillment"]
+EVENTS = ["failure", "repair", "reorder", "raw_material_stockout", "stockout"]
+
+class SimulationProfiler:
+    """Timing counters and event counts of the steps of one environment.
+
+    The duration of every phase of the first `trace_steps` profiled steps and
+    the first `trace_events` events are kept for the Chrome trace; the
+    counters cover all the profiled steps.
+    """
+    def __init__(self, env, trace_steps=10_000, trace_events=100_000):
+        self.env = env
+        self.trace_steps = trace_steps
+        self.trace_events = trace_events
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        """Clear the counters and the trace."""
+        self.steps = 0
+        self.time_ns = dict.fromkeys(PHASES, 0)
+        self.events = dict.fromkeys(EVENTS, 0)
+        self.trace = []
+        self.event_trace = []
+        self.origin_ns = time.perf_counter_ns()
+
+    def enable(self):
+        """Profile the following steps of the environment."""
+        self.env._advance = self._advance
+        self.enabled = True
+
+    def disable(self):
+        """Restore the uninstrumented step."""
+        self.env.__dict__.pop("_advance", None)
+        self.enabled = False
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def _event(self, name, clock):
+        self.events[name] += 1
+        if len(self.event_trace) < self.trace_events:
+            self.event_trace.append((name, self.steps, clock))
+
+    def _advance(self):
+        # The real step, with a clock read at the end of every phase
+        env = self.env
+        clocks = [time.perf_counter_ns()]
+        m1_was_operational = env.machine1.status == "operational"
+        m2_was_operational = env.machine2.status == "operational"
+        orders_placed = env.raw_material.orders_placed
+        requested = env.machine1.production_rate
+        raw_material_consumed = min(env.raw_material.inventory_on_hand, requested)
+        demand = env.accumulated_demand
+        fulfilled_demand = env.accumulated_fulfilled_demand
+
+        record = type(env)._advance(env, lambda: clocks.append(time.perf_counter_ns()))
+
+        for i, phase in enumerate(PHASES):
+            self.time_ns[phase] += clocks[i + 1] - clocks[i]
+        if self.steps < self.trace_steps:
+            self.trace.append(tuple(clocks))
+
+        t2, t3, t6 = clocks[2], clocks[3], clocks[6]
+        m1_operational, m2_operational = record[-2:]
+        for was_operational, operational in ((m1_was_operational, m1_operational),
+                                             (m2_was_operational, m2_operational)):
+            if was_operational and not operational:
+                self._event("failure", t3)
+            elif operational and not was_operational:
+                self._event("repair", t3)
+        if env.raw_material.orders_placed != orders_placed:
+            self._event("reorder", t2)
+        if raw_material_consumed < requested:
+            self._event("raw_material_stockout", t2)
+        if env.accumulated_fulfilled_demand - fulfilled_demand < env.accumulated_demand - demand:
+            self._event("stockout", t6)
+        self.steps += 1
+        return record
+
+    def summary(self):
+        """Return the counters as a text table."""
+        total = sum(self.time_ns.values()) or 1
+        lines = [f"{self.steps} steps profiled",
+                 f"{'phase':<22}{'total ms':>12}{'ns/step':>12}{'share':>9}"]
+        for phase in PHASES:
+            lines.append(f"{phase:<22}{self.time_ns[phase] / 1e6:>12.3f}"
+                         f"{self.time_ns[phase] / max(self.steps, 1):>12.0f}"
+                         f"{self.time_ns[phase] / total:>9.1%}")
+        lines.append(f"{'event':<22}{'count':>12}{'per 1k steps':>14}")
+        for event in EVENTS:
+            lines.append(f"{event:<22}{self.events[event]:>12}"
+                         f"{1000 * self.events[event] / max(self.steps, 1):>14.2f}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Return the trace as a Chrome trace-event dict: one slice per step
+        with a nested slice per phase, and an instant event per event."""
+        def microseconds(t):
+            return (t - self.origin_ns) / 1000
+        events = [{"name": "process_name", "ph": "M", "pid": os.getpid(),
+                   "args": {"name": "SimulationEnvironment"}}]
+        common = {"pid": os.getpid(), "tid": 0}
+        for step, clocks in enumerate(self.trace):
+            events.append({"name": "step", "cat": "step", "ph": "X", "ts": microseconds(clocks[0]),
+                           "dur": (clocks[6] - clocks[0]) / 1000, "args": {"step": step},
+                           **common})
+            for i, phase in enumerate(PHASES):
+                events.append({"name": phase, "cat": "phase", "ph": "X",
+                               "ts": microseconds(clocks[i]),
+                               "dur": (clocks[i + 1] - clocks[i]) / 1000, **common})
+        for name, step, clock in self.event_trace:
+            events.append({"name": name, "cat": "event", "ph": "i", "s": "t",
+                           "ts": microseconds(clock), "args": {"step": step}, **common})
+        return {"traceEvents": events, "displayTimeUnit": "ns",
+                "otherData": {"steps": self.steps, "time_ns": self.time_ns,
+                              "events": self.events}}
+
+    def export_chrome_trace(self, path):
+        """Write the Chrome trace to the JSON file `path`."""
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+def profiled_run_matches(seed=7, steps=5000):
+    """Return whether a profiled run() gives the same trajectory as an
+    unprofiled one with the same seed."""
+    import numpy as np
+    from inventory_system import SimulationEnvironment
+    expected = SimulationEnvironment(seed=seed).run(steps)
+    env = SimulationEnvironment(seed=seed)
+    with SimulationProfiler(env):
+        profiled = env.run(steps)
+    return np.array_equal(expected, profiled)
+
+
+if __name__ == "__main__":
+    from inventory_system import SimulationEnvironment
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, default=24 * 365)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--trace', default=None, help='write a Chrome trace to this file')
+    parser.add_argument('--check', action='store_true',
+                        help='check that profiling does not change the trajectory')
+    args = parser.parse_args()
+    if args.check and not profiled_run_matches():
+        parser.exit(1, 'Profiled and unprofiled runs differ\n')
+    env = SimulationEnvironment(seed=args.seed)
+    with SimulationProfiler(env) as profiler:
+        env.run(args.steps)
+    print(profiler.summary())
+    if args.trace:
+        profiler.export_chrome_trace(args.trace)
@@ -0,0 +1,150 @@
+"""NumPy-only inference for the LSTM surrogate trained in neural_network.py.
+
+export_surrogate() flattens a trained Keras model and its fitted scalers into
+a single .npz file; NumpySurrogate loads it and runs the forward pass with
+NumPy alone, so predictions do not need TensorFlow installed.
+"""
+import json
+import numpy as np
+
+def _sigmoid(x):
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+def _relu(x):
+    return np.maximum(x, 0)
+
+def _linear(x):
+    return x
+
+ACTIVATIONS = {
+    "tanh": np.tanh,
+    "sigmoid": _sigmoid,
+    "relu": _relu,
+    "linear": _linear,
+}
+
+def export_surrogate(model, x_scaler, y_scaler, path):
+    """Write the layers of a trained Keras model and the parameters of its
+    fitted MinMaxScalers to the .npz file `path`.
+
+    Supports the layers used by the surrogate: LSTM, Dense,
+    BatchNormalization and Dropout (which is a no-op at inference).
+    """
+    architecture = []
+    arrays = {
+        "x_scale": x_scaler.scale_, "x_min": x_scaler.min_,
+        "y_scale": y_scaler.scale_, "y_min": y_scaler.min_,
+    }
+    for index, layer in enumerate(model.layers):
+        kind = type(layer).__name__
+        config = layer.get_config()
+        weights = layer.get_weights()
+        prefix = f"layer{index}_"
+        if kind == "Dropout":
+            continue
+        if kind == "LSTM":
+            if config.get("go_backwards") or config.get("stateful"):
+                raise ValueError(f"Unsupported LSTM configuration in layer {layer.name}")
+            spec = {"kind": kind, "units": config["units"],
+                    "activation": config["activation"],
+                    "recurrent_activation": config["recurrent_activation"],
+                    "return_sequences": config["return_sequences"]}
+            names = ["kernel", "recurrent_kernel"] + (["bias"] if config["use_bias"] else [])
+        elif kind == "Dense":
+            spec = {"kind": kind, "activation": config["activation"]}
+            names = ["kernel"] + (["bias"] if config["use_bias"] else [])
+        elif kind == "BatchNormalization":
+            spec = {"kind": kind, "epsilon": config["epsilon"]}
+            names = ((["gamma"] if config["scale"] else []) + (["beta"] if config["center"] else [])
+                     + ["moving_mean", "moving_variance"])
+        else:
+            raise ValueError(f"Unsupported layer {layer.name} of type {kind}")
+        for name, weight in zip(names, weights):
+            arrays[prefix + name] = weight
+        spec["prefix"] = prefix
+        architecture.append(spec)
+    arrays["architecture"] = np.array(json.dumps(architecture))
+    np.savez(path, **arrays)
+
+class NumpySurrogate:
+    """Batched forward pass of an exported surrogate."""
+    def __init__(self, layers, x_scale, x_min, y_scale, y_min, dtype=np.float32):
+        self.layers = layers
+        self.x_scale = x_scale.astype(dtype)
+        self.x_min = x_min.astype(dtype)
+        self.y_scale = y_scale.astype(dtype)
+        self.y_min = y_min.astype(dtype)
+        self.dtype = dtype
+
+    @classmethod
+    def load(cls, path, dtype=np.float32):
+        """Load a surrogate written by export_surrogate()."""
+        with np.load(path) as data:
+            layers = []
+            for spec in json.loads(str(data["architecture"])):
+                prefix = spec["prefix"]
+                weights = {key[len(prefix):]: data[key].astype(dtype)
+                           for key in data.files if key.startswith(prefix)}
+                if spec["kind"] == "LSTM":
+                    units = spec["units"]
+                    weights.setdefault("bias", np.zeros(4 * units, dtype=dtype))
+                elif spec["kind"] == "Dense":
+                    weights.setdefault("bias", np.zeros(weights["kernel"].shape[1], dtype=dtype))
+                elif spec["kind"] == "BatchNormalization":
+                    # Fold the normalization into a single scale and offset
+                    scale = weights.get("gamma", 1) / np.sqrt(weights["moving_variance"]
+                                                              + spec["epsilon"])
+                    offset = weights.get("beta", 0) - weights["moving_mean"] * scale
+                    weights = {"scale": scale.astype(dtype), "offset": offset.astype(dtype)}
+                layers.append((spec, weights))
+            return cls(layers, data["x_scale"], data["x_min"], data["y_scale"],
+                       data["y_min"], dtype=dtype)
+
+    @staticmethod
+    def _lstm(x, spec, weights):
+        units = spec["units"]
+        activation = ACTIVATIONS[spec["activation"]]
+        recurrent_activation = ACTIVATIONS[spec["recurrent_activation"]]
+        # Input projections of every time step in one product
+        projected = x @ weights["kernel"] + weights["bias"]
+        recurrent_kernel = weights["recurrent_kernel"]
+        batch_size, time_steps, _ = x.shape
+        h = np.zeros((batch_size, units), dtype=x.dtype)
+        c = np.zeros((batch_size, units), dtype=x.dtype)
+        outputs = []
+        for t in range(time_steps):
+            z = projected[:, t] + h @ recurrent_kernel
+            i = recurrent_activation(z[:, :units])
+            f = recurrent_activation(z[:, units:2 * units])
+            g = activation(z[:, 2 * units:3 * units])
+            o = recurrent_activation(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * activation(c)
+            if spec["return_sequences"]:
+                outputs.append(h)
+        return np.stack(outputs, axis=1) if spec["return_sequences"] else h
+
+    def predict_scaled(self, x):
+        """Run the model on already scaled windows of shape
+        (batch, time_steps, features) and return the scaled outputs."""
+        x = np.asarray(x, dtype=self.dtype)
+        for spec, weights in self.layers:
+            if spec["kind"] == "LSTM":
+                x = self._lstm(x, spec, weights)
+            elif spec["kind"] == "Dense":
+                x = ACTIVATIONS[spec["activation"]](x @ weights["kernel"] + weights["bias"])
+            else:
+                x = x * weights["scale"] + weights["offset"]
+        return x
+
+    def predict(self, x, batch_size=4096):
+        """Predict the unscaled outputs for unscaled windows of shape
+        (batch, time_steps, features), `batch_size` windows at a time."""
+        x = np.asarray(x)
+        outputs = []
+        for start in range(0, len(x), batch_size):
+            scaled = x[start:start + batch_size] * self.x_scale + self.x_min
+            outputs.append((self.predict_scaled(scaled) - self.y_min) / self.y_scale)
+        if not outputs:
+            return np.empty((0, len(self.y_scale)), dtype=self.dtype)
+        return np.concatenate(outputs)
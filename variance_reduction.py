@@ -0,0 +1,122 @@
+"""
+Variance reduction for comparing two configurations of the production system.
+
+    python variance_reduction.py --kpi fill_rate --b machine2.mttr=12
+
+Every replication of a SimulationEnvironment draws the demand and the
+failures and repairs of each machine from its own stream, spawned from the
+seed of the replication. compare() runs both configurations with the same
+seeds, so they see the same demand and machine draws (common random numbers)
+and the noise mostly cancels in their difference. On top of that it can
+average each replication with its antithetic twin (mirrored draws), and
+adjust the differences with the realized demand as a control variate, whose
+exact mean is known. The variance-reduction factor it reports is the number
+of independent runs per configuration needed for the same precision,
+divided by the number used.
+"""
+import argparse
+import numpy as np
+from kpi_statistics import simulate_replication, t_quantile
+from markov_line import demand_distribution
+
+def expected_demand(demand_mean=7, demand_std=2):
+    """Exact mean of the demand per step of SimulationEnvironment.step()."""
+    values, probabilities = demand_distribution(demand_mean, demand_std)
+    return float(values @ probabilities)
+
+def control_variate(values, controls, control_mean):
+    """Control-variate estimate of the mean of `values`, using `controls`
+    with known mean `control_mean`.
+
+    Returns the adjusted values y - beta (c - control_mean), whose mean is
+    the estimate, and the fitted beta.
+    """
+    values = np.asarray(values, dtype=float)
+    controls = np.asarray(controls, dtype=float)
+    variance = controls.var(ddof=1)
+    beta = np.cov(values, controls)[0, 1] / variance if variance > 0 else 0.0
+    return values - beta * (controls - control_mean), float(beta)
+
+def compare(scenario_a, scenario_b, kpi="fill_rate", replications=50, common=True,
+            antithetic=False, control=False, confidence=0.95, seed=None, **options):
+    """Estimate the difference in `kpi` between two scenarios (dicts of
+    attribute paths as in inventory_data_generator.py).
+
+    Each of the `replications` is a pair of runs, one per scenario, with the
+    same seed if `common`. With `antithetic`, each run is averaged with the
+    same run on mirrored draws, doubling the runs. With `control`, the
+    differences are adjusted with the realized demand of the runs of
+    scenario a, whose exact mean is known; both scenarios must then have the
+    same demand parameters. The other keyword arguments are passed to
+    simulate_replication().
+
+    Returns the mean difference (b - a) and its half-width, the means of
+    both scenarios, and the variance-reduction factor: the variance of the
+    difference of independent single runs, var(a) + var(b), divided by the
+    variance of the difference per replication times the runs per
+    configuration of a replication.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(2 * replications)
+    seeds_a = seeds[:replications]
+    seeds_b = seeds_a if common else seeds[replications:]
+    variants = (False, True) if antithetic else (False,)
+    runs = {"a": [], "b": []}
+    for name, scenario, scenario_seeds in (("a", scenario_a, seeds_a), ("b", scenario_b, seeds_b)):
+        for seed_sequence in scenario_seeds:
+            runs[name].append([simulate_replication(seed_sequence, scenario=scenario,
+                                                    antithetic=variant, **options)
+                               for variant in variants])
+
+    def values(name, key):
+        # Replications x variants
+        return np.array([[run[key] for run in variants_runs] for variants_runs in runs[name]])
+
+    a, b = values("a", kpi), values("b", kpi)
+    differences = b.mean(axis=1) - a.mean(axis=1)
+    beta = None
+    if control:
+        demand = {**{"demand_mean": 7, "demand_std": 2}, **(scenario_a or {})}
+        differences, beta = control_variate(differences, values("a", "demand").mean(axis=1),
+                                            expected_demand(demand["demand_mean"],
+                                                            demand["demand_std"]))
+    variance = differences.var(ddof=1)
+    # Every run is a valid single independent run for the marginal variances
+    independent_variance = a.ravel().var(ddof=1) + b.ravel().var(ddof=1)
+    return {
+        "difference": float(differences.mean()),
+        "half_width": float(t_quantile(confidence, replications - 1)
+                            * np.sqrt(variance / replications)),
+        "mean_a": float(a.mean()),
+        "mean_b": float(b.mean()),
+        "runs": 2 * replications * len(variants),
+        "beta": beta,
+        "variance_reduction": float(independent_variance / (len(variants) * variance))
+                              if variance > 0 else np.inf,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--a', action='append', default=[], metavar='PATH=VALUE',
+                        help='parameter of scenario a, e.g. machine2.mttr=10')
+    parser.add_argument('--b', action='append', default=[], metavar='PATH=VALUE',
+                        help='parameter of scenario b, e.g. buffer.max_capacity=60')
+    parser.add_argument('--kpi', default='fill_rate')
+    parser.add_argument('--replications', type=int, default=50)
+    parser.add_argument('--horizon', type=int, default=24 * 90)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    scenarios = [{path: float(value) for path, value in (item.split('=') for item in items)}
+                 for items in (args.a, args.b)]
+    methods = [
+        ("independent", dict(common=False)),
+        ("common random numbers", dict()),
+        ("+ antithetic", dict(antithetic=True)),
+        ("+ control variate", dict(antithetic=True, control=True)),
+    ]
+    for label, method in methods:
+        result = compare(*scenarios, kpi=args.kpi, replications=args.replications,
+                         seed=args.seed, horizon=args.horizon, **method)
+        print(f"{label:>22}: {result['difference']:+.4f} +/- {result['half_width']:.4f} "
+              f"({result['runs']} runs, variance reduction x{result['variance_reduction']:.1f})")
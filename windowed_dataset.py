@@ -0,0 +1,77 @@
+"""Sliding-window sequence dataset over the generated training data."""
+import numpy as np
+
+def infer_scenario_id(parameters):
+    """Number the scenarios of a row-wise table of static scenario parameters,
+    starting a new scenario whenever any parameter changes."""
+    parameters = np.asarray(parameters)
+    changed = np.any(parameters[1:] != parameters[:-1], axis=1)
+    return np.concatenate(([0], np.cumsum(changed))).astype(np.int32)
+
+def _scale(values, scaler):
+    """Apply a fitted MinMaxScaler (or anything with `scale_` and `min_`)."""
+    if scaler is None:
+        return values
+    return values * scaler.scale_ + scaler.min_
+
+class WindowedDataset:
+    """Windows of `time_steps` rows of `x` with the row of `y` that follows
+    each of them as target.
+
+    Windows are strided views over `x`, which may be a memory-mapped array,
+    and only the rows of the requested batches are copied and scaled. Windows
+    never span two scenarios.
+    """
+    def __init__(self, x, y, scenario_id, time_steps=10, x_scaler=None, y_scaler=None,
+                 starts=None):
+        self.x = x
+        self.y = y
+        self.scenario_id = scenario_id
+        self.time_steps = time_steps
+        self.x_scaler = x_scaler
+        self.y_scaler = y_scaler
+        # Shape (n_windows, n_features, time_steps), without copying x
+        self.windows = np.lib.stride_tricks.sliding_window_view(x, time_steps, axis=0)
+        if starts is None:
+            scenario_id = np.asarray(scenario_id)
+            starts = np.flatnonzero(scenario_id[:-time_steps] == scenario_id[time_steps:])
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def subset(self, indices):
+        """Return a dataset with the windows at the given indices."""
+        return WindowedDataset(self.x, self.y, self.scenario_id, self.time_steps,
+                               self.x_scaler, self.y_scaler, starts=self.starts[indices])
+
+    def split(self, fraction):
+        """Split the windows in order into two datasets, the second one holding
+        `fraction` of them."""
+        split_index = int(len(self) * (1 - fraction))
+        return self.subset(slice(None, split_index)), self.subset(slice(split_index, None))
+
+    def batch(self, indices):
+        """Return the scaled (x, y) arrays of the windows at `indices`."""
+        starts = self.starts[indices]
+        x = self.windows[starts].transpose(0, 2, 1)
+        y = np.asarray(self.y[starts + self.time_steps])
+        return (_scale(x, self.x_scaler).astype(np.float32),
+                _scale(y, self.y_scaler).astype(np.float32))
+
+    def n_batches(self, batch_size):
+        """Number of batches of `batch_size` windows."""
+        return -(-len(self) // batch_size)
+
+    def batches(self, batch_size=32, shuffle=True, seed=None):
+        """Yield (x, y) mini-batches, in random order if `shuffle`."""
+        order = np.arange(len(self))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+        for i in range(0, len(order), batch_size):
+            # Sorted so that memory-mapped rows are read in order
+            yield self.batch(np.sort(order[i:i + batch_size]))
+
+    def arrays(self):
+        """Return all the windows as (x, y) arrays."""
+        return self.batch(slice(None))